@@ -0,0 +1,135 @@
+import time, threading
+from collections import OrderedDict
+
+#================================================================
+def parse_budget(text):
+    """Return (rate, burst) from text 'rate,burst', e.g. '200,400', None for empty text."""
+
+    if not text:
+        return None
+
+    rate, burst = (float(value) for value in text.split(','))
+
+    return rate, burst
+
+#================================================================
+class RateLimiter():
+    """Thread-safe token buckets of clients, one for every budget (e.g. read and write).
+    A bucket holds at most 'burst' tokens and gets 'rate' tokens per second,
+    every request takes one. Buckets of least recently seen clients are removed
+    over 'max_clients', such bucket would be full again anyway.
+    Optional:
+        max_clients - maximal number of remembered clients
+        budgets     - name=(rate, burst) of every budget, budget which is not set or
+                      is None is not limited"""
+
+    def __init__(self, max_clients=10_000, **budgets):
+        self.max_clients    = max_clients
+        self.budgets        = budgets
+        self._buckets       = OrderedDict()
+        self._lock          = threading.Lock()
+
+    #--------------------------------
+    def __repr__(self):
+        return f"Rate limiter of {len(self._buckets)} buckets with budgets {self.budgets}"
+
+    #--------------------------------
+    def acquire(self, client, budget, cost=1):
+        """Take 'cost' tokens from bucket of client.
+        Requirement:
+            client  - identifier of client, e.g. IP address
+            budget  - name of budget
+
+        Return:
+            0 if tokens are taken, otherwise seconds after which they will be available."""
+
+        limit = self.budgets.get(budget)
+
+        if not limit:
+            return 0
+
+        rate, burst = limit
+        key         = (client, budget)
+        now         = time.monotonic()
+
+        with self._lock:
+            if key in self._buckets:
+                tokens, updated = self._buckets[key]
+                tokens          = min(burst, tokens + (now - updated) * rate)
+                self._buckets.move_to_end(key)
+            else:
+                tokens = burst
+
+            if tokens >= cost:
+                tokens  -= cost
+                wait    = 0
+            else:
+                wait    = (cost - tokens) / rate
+
+            self._buckets[key] = (tokens, now)
+
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+
+        return wait
+
+    #--------------------------------
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+#================================================================
+class WriteQueue():
+    """Admission of writes: at most 'max_in_flight' writes run at once, next ones wait
+    in a queue of at most 'max_waiting' writes for at most 'max_wait' seconds.
+    SQLite has one writer, so more writes in flight only wait for its lock
+    and hold threads which would serve reads.
+    Optional:
+        max_in_flight   - maximal number of running writes
+        max_waiting     - maximal number of waiting writes, next ones are rejected at once
+        max_wait        - maximal time of waiting in seconds"""
+
+    def __init__(self, max_in_flight=2, max_waiting=32, max_wait=1.0):
+        self.max_in_flight  = max_in_flight
+        self.max_waiting    = max_waiting
+        self.max_wait       = max_wait
+        self.in_flight      = 0
+        self.waiting        = 0
+        self.rejected       = 0
+        self._condition     = threading.Condition()
+
+    #--------------------------------
+    def __repr__(self):
+        return f"Write queue with {self.in_flight}/{self.max_in_flight} writes in flight, {self.waiting} waiting"
+
+    #--------------------------------
+    def acquire(self):
+        """Wait for a free place of write, return False if the write is rejected."""
+
+        with self._condition:
+            if self.in_flight >= self.max_in_flight and self.waiting >= self.max_waiting:
+                self.rejected += 1
+                return False
+
+            self.waiting    += 1
+            admitted        = self._condition.wait_for(lambda: self.in_flight < self.max_in_flight,
+                                                       self.max_wait)
+            self.waiting    -= 1
+
+            if not admitted:
+                self.rejected += 1
+                return False
+
+            self.in_flight += 1
+            return True
+
+    #--------------------------------
+    def release(self):
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify()
+
+    #--------------------------------
+    @property
+    def stats(self):
+        return {'in_flight': self.in_flight, 'waiting': self.waiting, 'rejected': self.rejected}
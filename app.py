@@ -1,88 +1,379 @@
-from flask import Flask, abort
+from flask import Flask, Response, abort, g, make_response, request, stream_with_context
 from flask_restx import Api, Resource, fields
 from marshmallow import ValidationError
-import json
+from werkzeug.http import http_date
+import os, json, math, time, hashlib
 
-from models import Song, SongSchema
-from database import SQLiteDatabase
+from models import Song, SongSchema, migrations
+from database import SQLiteDatabase, SQLiteReplica
+from cache import LRUCache
+from encoding import compress_response, get_json_encoder
+from metrics import Metrics, Profiler
+from admission import RateLimiter, WriteQueue, parse_budget
 
 #================================================================
-database_file   = "db_file.db"
-database        = SQLiteDatabase(file=database_file)
-app             = Flask(__name__)
-api             = Api(app)
+database_file   = os.environ.get('SONGS_DATABASE', "db_file.db")
+database        = None                  # SQLiteDatabase created by create_app(), all writes go to it
+reader          = None                  # database or its local SQLiteReplica for reads, set by create_app()
+replica_age     = os.environ.get('SONGS_REPLICA_STALENESS')    # seconds, reads from a replica if it is set
+bulk_batch_size = 500
+song_columns    = ('song_id', 'band', 'album', 'nr', 'title')
+lookup_max_ids  = 1000
+song_cache      = LRUCache(max_size=10000, ttl=60)
+json_dumps      = get_json_encoder()    # orjson if it is installed, get_json_encoder('json') for stdlib
+compress_min    = 1024                  # responses smaller than that (bytes) are not compressed
+compress_level  = 1                     # 10k songs: 1.2 MiB to 0.37 MiB in ~18 ms, level 6 gives 0.31 MiB in ~32 ms
+changes_poll    = 0.25                  # seconds between checks of new changes by long-poll and stream
+changes_wait    = 30                    # maximal wait of long-poll in seconds
+changes_stream  = 300                   # seconds after which stream of changes ends, client continues it
+metrics         = Metrics()
+profiler        = Profiler(every=int(os.environ.get('SONGS_PROFILE_EVERY', 0)),   # every N-th request, 0 is off
+                           directory=os.environ.get('SONGS_PROFILE_DIRECTORY'))     # files of profiles, logged if not set
+# Limits are off by default: behind a proxy all clients have its address, then client_header
+# has to be set, otherwise they share one budget
+read_limit      = parse_budget(os.environ.get('SONGS_READ_LIMIT'))     # 'rate,burst' of one client, e.g. '200,400'
+write_limit     = parse_budget(os.environ.get('SONGS_WRITE_LIMIT'))    # e.g. '20,100', imports go through /songs/bulk
+read_rules      = ('/songs/lookup',)    # POST endpoints which only read
+client_header   = os.environ.get('SONGS_CLIENT_HEADER')   # e.g. 'X-Forwarded-For', remote address if not set
+limiter         = RateLimiter(read=read_limit, write=write_limit)
+write_in_flight = 2                     # more writes only wait for the lock of SQLite, see create_app()
+write_queue     = WriteQueue(max_in_flight=write_in_flight, max_waiting=32, max_wait=1.0)
+api             = Api()
 
 song_model = api.model('Song', {    'band_name':fields.String(required=True),
                                     'album_name':fields.String(required=True),
                                     'nr':fields.Integer(required=True),
                                     'title':fields.String(required=True)})
-                      
-database.connect()
-database.create_table(
-    table_name='songs',
-    song_id='text', primary_key='song_id',
-    band='text',
-    album='text',
-    nr='integer',
-    title='text',
-    _links='text'
-)
-
-songs = database.select_from_table('songs')
-database.disconnect()
-
-#--------------------------------
-def find_song_in_database(*, song=False, song_id=None):
+lookup_model = api.model('Lookup', {'ids':fields.List(fields.String, required=True)})
+
+metrics.add('cache_hits_total', 'counter', "Hits of songs cache")
+metrics.add('cache_misses_total', 'counter', "Misses of songs cache")
+metrics.add('cache_evictions_total', 'counter', "Songs evicted from cache")
+metrics.add('cache_size', 'gauge', "Number of songs in cache")
+metrics.add('http_rejections_total', 'counter', "Requests rejected by rate limit or write queue")
+metrics.add('write_queue_in_flight', 'gauge', "Number of running writes")
+metrics.add('write_queue_waiting', 'gauge', "Number of writes waiting in queue")
+
+#--------------------------------
+@api.representation('application/json')
+def output_json(data, code, headers=None):
+    response = make_response(json_dumps(data) + '\n', code)
+    response.headers.extend(headers or {})
+
+    return response
+
+#--------------------------------
+def prepare_database():
+    """Apply migrations before the first request to database,
+    for next requests it only compares version of schema."""
+
+    database.migrate(migrations)
+
+#--------------------------------
+def start_measurement():
+    metrics.start_request()
+    profiler.start()
+
+#--------------------------------
+def admit_request():
+    """Reject request of client over its budget of reads or writes, or write over
+    capacity of write queue, with 429 and Retry-After, before it touches database."""
+
+    endpoint    = request.url_rule.rule if request.url_rule else None
+    budget      = 'read' if request.method in ('GET', 'HEAD', 'OPTIONS') or endpoint in read_rules else 'write'
+    client      = request.remote_addr
+
+    if client_header and request.headers.get(client_header):
+        client = request.headers[client_header].split(',')[0].strip()
+
+    wait = limiter.acquire(client, budget)
+
+    if wait:
+        return reject_request(budget, 'rate_limit', wait)
+
+    if budget == 'write':
+        if not write_queue.acquire():
+            return reject_request(budget, 'write_queue', write_queue.max_wait)
+
+        g.write_admitted = True
+
+#--------------------------------
+def reject_request(budget, reason, wait):
+    metrics.observe('http_rejections_total', 1, budget=budget, reason=reason)
+
+    response = Response(json_dumps({'result': 'Too many requests, retry later'}) + '\n', 429,
+                        content_type='application/json')
+    response.headers['Retry-After'] = str(max(1, math.ceil(wait)))
+
+    return response
+
+#--------------------------------
+def release_write(exception=None):
+    if g.pop('write_admitted', False):
+        write_queue.release()
+
+#--------------------------------
+def record_measurement(response):
+    endpoint = request.url_rule.rule if request.url_rule else 'unknown'
+
+    profiler.stop(f"{request.method} {endpoint}")
+    metrics.finish_request(request.method, endpoint, response.status_code)
+
+    return response
+
+#--------------------------------
+def compress(response):
+    return compress_response(response, request.accept_encodings, compress_min, compress_level)
+
+#--------------------------------
+def find_song_in_database(song_id):
+    song = song_cache.get(song_id)
+
     if song:
-        database.connect()
-        result = database.select_from_table(
-            table_name='songs',
-            band=song.band_name,
-            album=song.album_name,
-            nr=song.nr,
-            title=song.title
-        )
-        database.disconnect()
+        return song
 
-        return bool(result)
+    # a write between this read and set() would leave the old song in cache
+    version = song_cache.version
 
-    if song_id:
-        database.connect()
-        result = database.select_from_table(
+    with reader:
+        result = reader.select_from_table(
             table_name='songs',
+            select=('band', 'album', 'nr', 'title'),
             song_id=song_id
         )
-        database.disconnect()
-
-        if result:
-            result  = result[0]
-            song    = Song(
-                band_name=result['band'],
-                album_name=result['album'],
-                nr=result['nr'],
-                title=result['title']
-            )
-            song.song_id = song_id
 
-            return song
+    if result:
+        song = Song.from_row(result[0], song_id)
+        song_cache.set(song_id, song, version=version)
+
+        return song
 
     return False
 
+#--------------------------------
+def lookup_songs(ids):
+    """Return songs with IDs from cache or database by one query
+    and list of IDs which are not found."""
+
+    ids = list(dict.fromkeys(ids))
+
+    if len(ids) > lookup_max_ids:
+        return {'result': f"Maximal number of IDs is {lookup_max_ids}"}, 400
+
+    songs   = {}
+    missed  = []
+
+    for song_id in ids:
+        song = song_cache.get(song_id)
+
+        if song:
+            songs[song_id] = song
+        else:
+            missed.append(song_id)
+
+    if missed:
+        version = song_cache.version
+
+        with reader:
+            rows = reader.select_in('songs', 'song_id', missed, select=song_columns)
+
+        for row in rows:
+            song                    = Song.from_row(row)
+            songs[song.song_id]     = song
+            song_cache.set(song.song_id, song, version=version)
+
+    return {
+        'songs':    {song_id: songs[song_id].dump() for song_id in ids if song_id in songs},
+        'missing':  [song_id for song_id in ids if song_id not in songs]
+    }
+
+#--------------------------------
+def check_version(table_name):
+    """Return True if client has current version of requested resource
+    (If-None-Match or If-Modified-Since) and headers with ETag and Last-Modified.
+    ETag is made from version of table, so content is not loaded to compute it."""
+
+    with reader:
+        version, modified = reader.table_version(table_name)
+
+    # Last-Modified has whole seconds and the next write can be in the same second,
+    # so the end of the second is sent only after it is over, before that its start,
+    # which is older than the change and never gives 304
+    last_modified = int(modified) + 1 if int(modified) + 1 <= time.time() else int(modified)
+
+    etag    = hashlib.sha1(f"{version} {request.full_path} {request.accept_mimetypes} "
+                           f"{request.accept_encodings}".encode()).hexdigest()
+    headers = {'ETag': f'"{etag}"', 'Last-Modified': http_date(last_modified)}
+
+    if request.if_none_match:
+        return request.if_none_match.contains(etag), headers
+
+    if request.if_modified_since:
+        return modified < request.if_modified_since.timestamp(), headers
+
+    return False, headers
+
+#--------------------------------
+def check_song_version(data):
+    """Return True if client has current version of song (If-None-Match) and headers with ETag.
+    ETag is made from the song, so a song from cache needs no query
+    and writes of other songs do not change it."""
+
+    etag = hashlib.sha1(f"{json_dumps(data)} {request.accept_mimetypes} "
+                        f"{request.accept_encodings}".encode()).hexdigest()
+
+    return request.if_none_match.contains(etag), {'ETag': f'"{etag}"'}
+
+#--------------------------------
+def read_list_arguments():
+    """Return arguments of select_from_table() made from filters, fields and order_by
+    parameters of request and error message if parameters are incorrect."""
+
+    arguments = {}
+
+    for column in ('band', 'album'):
+        values = request.args.getlist(column)
+
+        if len(values) == 1:
+            arguments[column] = values[0]
+        elif values:
+            arguments[f"{column}__in"] = values
+
+    for name, operator in (('nr_min', 'ge'), ('nr_max', 'le')):
+        if name in request.args:
+            value = request.args.get(name, type=int)
+
+            if value is None:
+                return None, f"Parameter {name} must be a number"
+
+            arguments[f"nr__{operator}"] = value
+
+    fields      = [name for name in request.args.get('fields', '').split(',') if name]
+    order_by    = [name for name in request.args.get('order_by', '').split(',') if name]
+    unknown     = [name for name in fields + [name.lstrip('-') for name in order_by] if name not in song_columns]
+
+    if unknown:
+        return None, f"Unknown columns: {', '.join(unknown)}"
+
+    if fields:
+        arguments['select'] = fields
+
+    if order_by:
+        arguments['order_by'] = order_by
+
+    return arguments, None
+
 #--------------------------------
 @api.route('/songs')
 class SongsAll(Resource):
     @api.response(200, 'Success - Songs are loaded')
+    @api.response(304, 'Not Modified - Songs are not changed since last request')
+    @api.response(400, 'Bad Request - Parameters of page are incorrect')
+    @api.doc(params={
+        'band':     'Band of songs, can be repeated',
+        'album':    'Album of songs, can be repeated',
+        'nr_min':   'Minimal number of song on album',
+        'nr_max':   'Maximal number of song on album',
+        'fields':   'Comma separated columns of songs, all by default',
+        'order_by': 'Comma separated columns of ordering, "-" before column for descending',
+        'limit':    'Maximal number of songs on a page',
+        'offset':   'Number of skipped songs, for pages with order_by',
+        'after':    'ID of the last song from previous page, for pages without order_by',
+        'stream':   'Send songs as NDJSON stream (also by Accept: application/x-ndjson)'
+    })
     def get(self):
-        database.connect()
-        result = database.select_from_table(table_name='songs')
-        database.disconnect()
+        limit   = request.args.get('limit', type=int)
+        offset  = request.args.get('offset', type=int)
+        after   = request.args.get('after')
+        stream  = request.args.get('stream', 'false').lower() in ('1', 'true', 'yes') \
+            or request.accept_mimetypes.best == 'application/x-ndjson'
+
+        arguments, error = read_list_arguments()
+
+        if error:
+            return {'result': error}, 400
+
+        # Parameter which is not a number must not turn into no limit and load all songs
+        for name, value in (('limit', limit), ('offset', offset)):
+            if value is None and name in request.args:
+                return {'result': f"Parameter {name} must be a number"}, 400
+
+        if after == '':
+            return {'result': 'Parameter after must be ID of a song'}, 400
+
+        if limit is not None and limit < 1 or offset is not None and offset < 0:
+            return {'result': 'Limit must be a positive number and offset can not be negative'}, 400
+
+        if after is not None and ('order_by' in arguments or offset):
+            return {'result': 'Parameter after can not be used with order_by or offset'}, 400
+
+        # Pages without order_by are ordered by song_id and continue after the last one
+        keyset = after is not None or limit is not None and 'order_by' not in arguments
+
+        if keyset:
+            arguments['order_by']   = 'song_id'
+            arguments['after']      = after
+
+            if 'song_id' not in arguments.get('select', ['song_id']):
+                arguments['select'].append('song_id')
+
+        not_modified, headers = check_version('songs')
+
+        if not_modified:
+            return None, 304, headers
+
+        if stream:
+            if limit:
+                # Body is sent after headers, so the last song of the page is found first
+                last = next(reader.iter_select(table_name='songs', limit=1, offset=(offset or 0) + limit - 1,
+                                               **{**arguments, 'select': 'song_id'}), None)
+
+                if last:
+                    headers['Link'] = self.next_page(last, keyset, limit, offset)
+
+            rows = reader.iter_select(table_name='songs', limit=limit, offset=offset, **arguments)
+            return Response(
+                stream_with_context(json_dumps(row) + '\n' for row in rows),
+                mimetype='application/x-ndjson',
+                headers=headers
+            )
+
+        if not keyset and limit is None:
+            with reader:
+                result = reader.select_from_table(table_name='songs', offset=offset, **arguments)
+
+            return result, 200, headers
+
+        result = list(reader.iter_select(table_name='songs', limit=limit, offset=offset, **arguments))
 
-        return result
+        if limit and len(result) == limit:
+            headers['Link'] = self.next_page(result[-1], keyset, limit, offset)
+
+        return result, 200, headers
+
+    #--------------------------------
+    @staticmethod
+    def next_page(last, keyset, limit, offset):
+        """Return Link header of the page after full page which ends with song 'last'."""
+
+        arguments = request.args.to_dict(flat=False)
+
+        if keyset:
+            # after can not be used with offset, the next page only continues after the last song
+            arguments.pop('offset', None)
+            next_page = {'after': last['song_id']}
+        else:
+            next_page = {'offset': (offset or 0) + limit}
+
+        next_page = api.url_for(SongsAll, **{**arguments, **next_page})
+
+        return f'<{next_page}>; rel="next"'
 
     #--------------------------------
     @api.response(201, 'Created - Song is added to database')
     @api.response(400, 'Bad Request - Request is not complete or is incorrect')
     @api.response(409, 'Conflict - Song is already in database')
+    @api.response(503, 'Service Unavailable - Song is not added because of an error of database')
     @api.expect(song_model, validate=True)
     def post(self):
         try:
@@ -90,10 +381,10 @@ class SongsAll(Resource):
         except ValidationError as error:
             return error.messages, 400
 
-        if not find_song_in_database(song=result):
-            database.connect()
-            database.add_to_table(
+        with database:
+            created = database.add_to_table(
                 table_name='songs',
+                on_conflict='nothing',
                 song_id=result.song_id,
                 band=result.band_name,
                 album=result.album_name,
@@ -101,32 +392,282 @@ class SongsAll(Resource):
                 title=result.title,
                 #_links=json.dumps(result._links)
             )
-            database.disconnect()
 
+        if created:
             return {'result': 'Song is added'}, 201
+        elif created is None:
+            return {'result': 'Song is not added, retry later'}, 503
         else:
             return {'result': 'Song is already in database'}, 409
 
+#--------------------------------
+@api.route('/songs/search')
+class SongsSearch(Resource):
+    @api.response(200, 'Success - Found songs are loaded, the best matches first')
+    @api.response(304, 'Not Modified - Songs are not changed since last request')
+    @api.response(400, 'Bad Request - Parameters of search are incorrect')
+    @api.doc(params={
+        'q':        'Words to find in band, album and title',
+        'limit':    'Maximal number of songs on a page (max 100)',
+        'offset':   'Number of skipped songs'
+    })
+    def get(self):
+        query   = request.args.get('q', '')
+        limit   = request.args.get('limit', type=int)
+        offset  = request.args.get('offset', type=int)
+
+        if not query.strip():
+            return {'result': 'Parameter q is required'}, 400
+
+        # Parameter which is not a number must not turn into its default
+        for name, value in (('limit', limit), ('offset', offset)):
+            if value is None and name in request.args:
+                return {'result': f"Parameter {name} must be a number"}, 400
+
+        limit   = 20 if limit is None else limit
+        offset  = offset or 0
+
+        if not 0 < limit <= 100 or offset < 0:
+            return {'result': 'Limit must be between 1 and 100 and offset can not be negative'}, 400
+
+        not_modified, headers = check_version('songs')
+
+        if not_modified:
+            return None, 304, headers
+
+        with reader:
+            result = reader.search('songs', query, limit=limit, offset=offset)
+
+        if len(result) == limit:
+            next_page       = api.url_for(SongsSearch, q=query, limit=limit, offset=offset + limit)
+            headers['Link'] = f'<{next_page}>; rel="next"'
+
+        return result, 200, headers
+
+#--------------------------------
+def read_changes(since, limit):
+    """Return changes of songs after sequence number 'since' with current songs,
+    song is None if it is removed."""
+
+    with database:
+        rows = database.changes('songs', 'song_id', since, limit, select=song_columns)
+
+    return [{
+        'seq':          row['seq'],
+        'song_id':      row['key'],
+        'operation':    row['operation'],
+        'changed':      row['changed'],
+        'song':         {column: row[column] for column in song_columns} if row['song_id'] else None
+    } for row in rows]
+
+#--------------------------------
+def change_events(since, limit):
+    """Yield changes after 'since' as server-sent events until changes_stream seconds pass,
+    with a comment every 15 seconds without changes, so proxies keep connection open."""
+
+    deadline    = time.monotonic() + changes_stream
+    sent        = time.monotonic()
+
+    yield f"retry: {int(changes_poll * 1000)}\n\n"
+
+    while time.monotonic() < deadline:
+        changes = read_changes(since, limit)
+
+        for change in changes:
+            yield f"id: {change['seq']}\nevent: change\ndata: {json_dumps(change)}\n\n"
+
+        if changes:
+            since   = changes[-1]['seq']
+            sent    = time.monotonic()
+            continue
+
+        if time.monotonic() - sent > 15:
+            yield ": keep-alive\n\n"
+            sent = time.monotonic()
+
+        time.sleep(changes_poll)
+
+#--------------------------------
+@api.route('/songs/changes')
+class SongsChanges(Resource):
+    @api.response(200, 'Success - Changes after sequence number since are loaded, the oldest first')
+    @api.response(400, 'Bad Request - Parameters of changes are incorrect')
+    @api.doc(params={
+        'since':    'Sequence number of the last known change, without it only the last number is returned',
+        'limit':    'Maximal number of changes (max 1000)',
+        'wait':     f'Seconds to wait for a change if there is none yet (max {changes_wait})',
+        'stream':   'Send changes as server-sent events (also by Accept: text/event-stream), '
+                    'Last-Event-ID header continues a stream'
+    })
+    def get(self):
+        """Changes of songs for incremental sync: read 'last' without since, then get all songs
+        and after that only changes since 'last'."""
+
+        since   = request.args.get('since', type=int)
+        limit   = request.args.get('limit', type=int)
+        wait    = request.args.get('wait', type=float)
+        stream  = request.args.get('stream', 'false').lower() in ('1', 'true', 'yes') \
+            or request.accept_mimetypes.best == 'text/event-stream'
+
+        if since is None and 'since' in request.args or since is not None and since < 0:
+            return {'result': 'Parameter since must be a sequence number'}, 400
+
+        # Parameter which is not a number must not turn into its default
+        for name, value in (('limit', limit), ('wait', wait)):
+            if value is None and name in request.args:
+                return {'result': f"Parameter {name} must be a number"}, 400
+
+        limit   = 100 if limit is None else limit
+        wait    = wait or 0
+
+        if not 0 < limit <= 1000 or not 0 <= wait <= changes_wait:
+            return {'result': f"Limit must be between 1 and 1000 and wait between 0 and {changes_wait}"}, 400
+
+        if stream:
+            since = request.headers.get('Last-Event-ID', since, type=int)
+
+        if since is None:
+            with database:
+                last = database.last_change('songs')
+
+            if not stream:
+                return {'changes': [], 'last': last}
+
+            since = last
+
+        if stream:
+            return Response(change_events(since, limit), mimetype='text/event-stream',
+                            headers={'Cache-Control': 'no-cache'})
+
+        deadline    = time.monotonic() + wait
+        changes     = read_changes(since, limit)
+
+        while not changes and time.monotonic() < deadline:
+            time.sleep(changes_poll)
+            changes = read_changes(since, limit)
+
+        last    = changes[-1]['seq'] if changes else since
+        headers = {}
+
+        if len(changes) == limit:
+            next_page       = api.url_for(SongsChanges, since=last, limit=limit)
+            headers['Link'] = f'<{next_page}>; rel="next"'
+
+        return {'changes': changes, 'last': last}, 200, headers
+
+#--------------------------------
+@api.route('/songs/lookup')
+class SongsLookup(Resource):
+    @api.response(200, 'Success - Found songs are loaded by ID, missing IDs are listed')
+    @api.response(400, 'Bad Request - List of IDs is incorrect')
+    @api.doc(params={'ids': 'Comma separated IDs of songs, can be repeated'})
+    def get(self):
+        ids = [song_id for value in request.args.getlist('ids') for song_id in value.split(',') if song_id]
+
+        return lookup_songs(ids)
+
+    #--------------------------------
+    @api.response(200, 'Success - Found songs are loaded by ID, missing IDs are listed')
+    @api.response(400, 'Bad Request - List of IDs is incorrect')
+    @api.expect(lookup_model)
+    def post(self):
+        payload = request.get_json(silent=True) if request.is_json else None
+        ids     = payload.get('ids') if isinstance(payload, dict) else None
+
+        if not isinstance(ids, list) or not all(isinstance(song_id, str) for song_id in ids):
+            return {'result': 'Request must have a list of IDs'}, 400
+
+        return lookup_songs(ids)
+
+#--------------------------------
+@api.route('/songs/bulk')
+class SongsBulk(Resource):
+    @api.response(201, 'Created - Songs are processed, see status of every song')
+    @api.response(400, 'Bad Request - Request is not a list of songs')
+    @api.expect([song_model])
+    def post(self):
+        """Add many songs from JSON array or NDJSON stream (application/x-ndjson)."""
+
+        if request.mimetype == 'application/x-ndjson':
+            items = []
+
+            for line in request.stream:
+                if line.strip():
+                    try:
+                        items.append(json.loads(line))
+                    except ValueError:
+                        items.append(None)
+        else:
+            items = request.get_json(silent=True)
+
+            if not isinstance(items, list):
+                return {'result': 'Request must be a list of songs'}, 400
+
+        schema  = SongSchema(many=True)
+        errors  = schema.validate(items)
+        valid   = [index for index in range(len(items)) if index not in errors]
+        songs   = schema.load([items[index] for index in valid])
+
+        with database:
+            added = database.add_many(
+                table_name='songs',
+                rows=({ 'song_id':  song.song_id,
+                        'band':     song.band_name,
+                        'album':    song.album_name,
+                        'nr':       song.nr,
+                        'title':    song.title      } for song in songs),
+                key='song_id',
+                batch_size=bulk_batch_size,
+                on_conflict='nothing'
+            )
+
+        result = [{'index': index, 'status': 'invalid', 'errors': errors[index]} for index in errors]
+
+        for index, song, created in zip(valid, songs, added):
+            if created:
+                result.append({'index': index, 'status': 'created', 'song_id': song.song_id})
+            elif created is None:
+                result.append({'index': index, 'status': 'error'})
+            else:
+                result.append({'index': index, 'status': 'duplicate'})
+
+        result.sort(key=lambda item: item['index'])
+
+        return {
+            'created':      sum(item['status'] == 'created' for item in result),
+            'duplicate':    sum(item['status'] == 'duplicate' for item in result),
+            'error':        sum(item['status'] == 'error' for item in result),
+            'invalid':      len(errors),
+            'songs':        result
+        }, 201
+
 #--------------------------------
 @api.route('/songs/<song_id>')
 class SongsWithID(Resource):
     @api.response(200, 'Success - Song is loaded')
+    @api.response(304, 'Not Modified - Song is not changed since last request')
     @api.response(409, 'Conflict - Song is already in database')
     def get(self, song_id):
-        schema  = SongSchema()
-        song    = find_song_in_database(song_id=song_id)
+        song = find_song_in_database(song_id=song_id)
 
-        if song:
-            result = schema.dump(song)
-            return result
-        else:
+        if not song:
             return {'result': 'Song is not find in database'}, 404
 
+        data                    = song.dump()
+        not_modified, headers   = check_song_version(data)
+
+        if not_modified:
+            return None, 304, headers
+
+        return data, 200, headers
+
     #--------------------------------
     @api.expect(song_model, validate=True)
     @api.response(200, 'Success - Song is modified')
     @api.response(400, 'Bad Request - Request is not complete or is incorrect')
+    @api.response(409, 'Conflict - Song is already in database')
     @api.response(440, 'Not Found - Song ID is not found')
+    @api.response(503, 'Service Unavailable - Song is not modified because of an error of database')
     def put(self, song_id):
         schema  = SongSchema()
         song    = find_song_in_database(song_id=song_id)
@@ -140,17 +681,24 @@ class SongsWithID(Resource):
             except ValidationError as error:
                 return error.messages, 400
 
-            database.connect()
-            database.update_row(
-                table_name='songs',
-                primary_key={'name': 'song_id', 'value': song_id},
-                band=result.band_name,
-                album=result.album_name,
-                nr=result.nr,
-                title=result.title,
-                #_links=json.dumps(result._links)
-            )
-            database.disconnect()
+            with database:
+                modified = database.update_row(
+                    table_name='songs',
+                    primary_key={'name': 'song_id', 'value': song_id},
+                    band=result.band_name,
+                    album=result.album_name,
+                    nr=result.nr,
+                    title=result.title,
+                    #_links=json.dumps(result._links)
+                )
+
+            song_cache.invalidate(song_id)
+
+            if modified is None:
+                return {'result': 'Song is not modified, retry later'}, 503
+
+            if not modified:
+                return {'result': 'Song is already in database'}, 409
 
             return {'result': 'Song is modified'}
 
@@ -161,17 +709,170 @@ class SongsWithID(Resource):
         song = find_song_in_database(song_id=song_id)
 
         if song:
-            database.connect()
-            database.delete(
-                table_name='songs',
-                song_id=song_id
-            )
-            database.disconnect()
+            with database:
+                database.delete(
+                    table_name='songs',
+                    song_id=song_id
+                )
+
+            song_cache.invalidate(song_id)
             
             return {'result': 'Song is removed'}
         else:
             abort(404)
 
+#--------------------------------
+@api.route('/bands')
+class Bands(Resource):
+    @api.response(200, 'Success - Bands with numbers of their albums and tracks are loaded')
+    @api.response(304, 'Not Modified - Songs are not changed since last request')
+    @api.response(400, 'Bad Request - Limit is not a positive number')
+    @api.doc(params={
+        'limit':    'Maximal number of bands on a page',
+        'after':    'Name of the last band from previous page'
+    })
+    def get(self):
+        limit   = request.args.get('limit', type=int)
+        after   = request.args.get('after')
+
+        if limit is None and 'limit' in request.args or limit is not None and limit < 1:
+            return {'result': 'Limit must be a positive number'}, 400
+
+        not_modified, headers = check_version('songs')
+
+        if not_modified:
+            return None, 304, headers
+
+        # Summary is kept by triggers of songs, see models.songs_summaries
+        result = list(reader.iter_select(table_name='songs_bands', order_by='band', after=after, limit=limit))
+
+        if limit and len(result) == limit:
+            next_page       = api.url_for(Bands, limit=limit, after=result[-1]['band'])
+            headers['Link'] = f'<{next_page}>; rel="next"'
+
+        return result, 200, headers
+
+#--------------------------------
+@api.route('/bands/<path:band>/albums')
+class BandAlbums(Resource):
+    @api.response(200, 'Success - Albums of band with numbers of tracks are loaded')
+    @api.response(304, 'Not Modified - Songs are not changed since last request')
+    @api.response(404, 'Not Found - Band is not found')
+    def get(self, band):
+        not_modified, headers = check_version('songs')
+
+        if not_modified:
+            return None, 304, headers
+
+        with reader:
+            result = reader.select_from_table(
+                table_name='songs_albums',
+                select=('album', 'tracks'),
+                order_by='album',
+                band=band
+            )
+
+        if not result:
+            return {'result': 'Band is not found in database'}, 404
+
+        return result, 200, headers
+
+#--------------------------------
+@api.route('/albums/<path:album>/songs')
+class AlbumSongs(Resource):
+    @api.response(200, 'Success - Albums with this name and their tracklists ordered by nr are loaded')
+    @api.response(304, 'Not Modified - Songs are not changed since last request')
+    @api.response(404, 'Not Found - Album is not found')
+    @api.doc(params={'band': 'Band of album, albums of all bands with this name by default'})
+    def get(self, album):
+        arguments = {'album': album}
+
+        if 'band' in request.args:
+            arguments['band'] = request.args['band']
+
+        not_modified, headers = check_version('songs')
+
+        if not_modified:
+            return None, 304, headers
+
+        with reader:
+            result = reader.select_from_table(table_name='songs_albums', order_by='band', **arguments)
+
+        if not result:
+            return {'result': 'Album is not found in database'}, 404
+
+        for row in result:
+            row['tracklist'] = json.loads(row['tracklist'])
+
+        return result, 200, headers
+
+#--------------------------------
+@api.route('/cache')
+class CacheStats(Resource):
+    @api.response(200, 'Success - Counters of songs cache are loaded')
+    def get(self):
+        return song_cache.stats
+
+#--------------------------------
+@api.route('/metrics')
+class MetricsExport(Resource):
+    @api.response(200, 'Success - Metrics of requests, database and cache are loaded in Prometheus text format')
+    def get(self):
+        metrics.set('cache_hits_total', song_cache.hits)
+        metrics.set('cache_misses_total', song_cache.misses)
+        metrics.set('cache_evictions_total', song_cache.evictions)
+        metrics.set('cache_size', len(song_cache))
+        metrics.set('write_queue_in_flight', write_queue.in_flight)
+        metrics.set('write_queue_waiting', write_queue.waiting)
+
+        return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+#================================================================
+def create_app(file=None, max_staleness=replica_age, **options):
+    """Create Flask application with API of songs. Database is not opened here,
+    it is opened and migrated by the first request. Database, cache, metrics
+    and rate limits are kept in this module, so one process serves one application.
+    Optional:
+        file            - path to database file, database_file by default
+        max_staleness   - read from a local replica of database, refreshed when it is
+                          older than that (seconds), None reads from database file
+        options         - options of SQLiteDatabase
+
+    Return:
+        Flask application"""
+
+    global database, reader
+
+    database = SQLiteDatabase(file=file or database_file, **{'slow_query_threshold': 0.1, **options})
+    database.query_hooks.append(metrics.query_hook)
+
+    if max_staleness is not None:
+        reader = SQLiteReplica(database, max_staleness=float(max_staleness))
+        reader.query_hooks.append(metrics.query_hook)
+    else:
+        reader = database
+
+    # with group commit writes wait for the writer thread, which commits together only writes in flight
+    write_queue.max_in_flight = database.writer.max_size if database.writer else write_in_flight
+
+    song_cache.clear()
+    limiter.clear()
+
+    app = Flask(__name__)
+    app.before_request(start_measurement)
+    app.before_request(admit_request)
+    app.before_request(prepare_database)
+    app.teardown_request(release_write)
+    # after_request functions run in reverse order, so the request is recorded after compression
+    app.after_request(record_measurement)
+    app.after_request(compress)
+    api.init_app(app)
+
+    return app
+
+#--------------------------------
+app = create_app()
+
 #================================================================
 if __name__ == "__main__":
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,180 @@
+import os, json, re
+from urllib.parse import parse_qs
+
+from marshmallow import ValidationError
+
+from models import Song, SongSchema, migrations
+from async_database import AsyncSQLiteDatabase
+
+#================================================================
+# ASGI version of app.py, run with: uvicorn async_app:app
+database_file   = os.environ.get('SONGS_DATABASE', "db_file.db")    # the same file as app.py
+database        = AsyncSQLiteDatabase(database_file, workers=8)
+song_path       = re.compile(r'^/songs/(?P<song_id>[^/]+)$')
+
+#--------------------------------
+async def read_body(receive):
+    body = b''
+
+    while True:
+        message = await receive()
+        body    += message.get('body', b'')
+
+        if not message.get('more_body'):
+            return body
+
+#--------------------------------
+async def send_json(send, status, data, headers=()):
+    body = json.dumps(data).encode()
+
+    await send({
+        'type':     'http.response.start',
+        'status':   status,
+        'headers':  [(b'content-type', b'application/json'),
+                     (b'content-length', str(len(body)).encode()), *headers]
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+#--------------------------------
+def load_song(body):
+    """Return Song from JSON body or tuple with errors and status 400."""
+
+    try:
+        return SongSchema().load(json.loads(body or b'null') or {})
+    except ValueError:
+        return {'result': 'Request is not JSON'}, 400
+    except ValidationError as error:
+        return error.messages, 400
+
+#--------------------------------
+async def find_song_in_database(song_id):
+    result = await database.select_from_table(
+        table_name='songs',
+        select=('band', 'album', 'nr', 'title'),
+        song_id=song_id
+    )
+
+    if result:
+        return Song.from_row(result[0], song_id)
+
+    return False
+
+#================================================================
+async def songs_all(method, query, body):
+    if method == 'GET':
+        try:
+            limit = int(query['limit'][0]) if 'limit' in query else None
+        except ValueError:
+            limit = 0
+
+        after = query.get('after', [None])[0]
+
+        if limit is not None and limit < 1:
+            return {'result': 'Limit must be a positive number'}, 400
+
+        if limit is None and after is None:
+            return await database.select_from_table(table_name='songs'), 200
+
+        result  = await database.iter_select(table_name='songs', order_by='song_id', after=after, limit=limit)
+        headers = []
+
+        if len(result) == limit:
+            next_page = f"/songs?limit={limit}&after={result[-1]['song_id']}"
+            headers.append((b'link', f'<{next_page}>; rel="next"'.encode()))
+
+        return result, 200, headers
+
+    if method == 'POST':
+        result = load_song(body)
+
+        if isinstance(result, tuple):
+            return result
+
+        created = await database.add_to_table(
+            table_name='songs',
+            on_conflict='nothing',
+            song_id=result.song_id,
+            band=result.band_name,
+            album=result.album_name,
+            nr=result.nr,
+            title=result.title
+        )
+
+        if created:
+            return {'result': 'Song is added'}, 201
+        elif created is None:
+            return {'result': 'Song is not added, retry later'}, 503
+        else:
+            return {'result': 'Song is already in database'}, 409
+
+    return {'result': 'Method is not allowed'}, 405
+
+#--------------------------------
+async def songs_with_id(method, song_id, body):
+    song = await find_song_in_database(song_id)
+
+    if not song:
+        return {'result': 'Song is not found in database'}, 404
+
+    if method == 'GET':
+        return song.dump(), 200
+
+    if method == 'PUT':
+        result = load_song(body)
+
+        if isinstance(result, tuple):
+            return result
+
+        modified = await database.update_row(
+            table_name='songs',
+            primary_key={'name': 'song_id', 'value': song_id},
+            band=result.band_name,
+            album=result.album_name,
+            nr=result.nr,
+            title=result.title
+        )
+
+        if modified is None:
+            return {'result': 'Song is not modified, retry later'}, 503
+
+        if not modified:
+            return {'result': 'Song is already in database'}, 409
+
+        return {'result': 'Song is modified'}, 200
+
+    if method == 'DELETE':
+        await database.delete(table_name='songs', song_id=song_id)
+        return {'result': 'Song is removed'}, 200
+
+    return {'result': 'Method is not allowed'}, 405
+
+#================================================================
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+
+            if message['type'] == 'lifespan.startup':
+                await database.migrate(migrations)
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await database.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    if scope['type'] != 'http':
+        return
+
+    method  = scope['method']
+    path    = scope['path'].rstrip('/')
+    body    = await read_body(receive)
+    match   = song_path.match(path)
+
+    if path == '/songs':
+        data, status, *headers = await songs_all(method, parse_qs(scope['query_string'].decode()), body)
+    elif match:
+        data, status, *headers = await songs_with_id(method, match['song_id'], body)
+    else:
+        data, status, headers = {'result': 'Not found'}, 404, []
+
+    await send_json(send, status, data, headers[0] if headers else ())
@@ -0,0 +1,82 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from database import SQLiteDatabase
+
+#================================================================
+class AsyncSQLiteDatabase():
+    """Awaitable access to SQLiteDatabase for asyncio applications.
+    Every call runs in one of 'workers' threads, each thread keeps its own
+    connection from the pool of SQLiteDatabase, so the event loop never
+    waits for SQLite.
+    Requirement:
+        database    - SQLiteDatabase or path to database file
+
+    Optional:
+        workers     - number of threads with connections"""
+
+    def __init__(self, database, workers=4):
+        if not isinstance(database, SQLiteDatabase):
+            database = SQLiteDatabase(file=database, pool_size=workers)
+
+        self.database   = database
+        self._executor  = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='sqlite')
+
+    #--------------------------------
+    def __repr__(self):
+        return f"Async {self.database}"
+
+    #--------------------------------
+    async def _run(self, function, *args, **kwargs):
+        """Call function of database with connection in a worker thread."""
+
+        def call():
+            with self.database:
+                return function(*args, **kwargs)
+
+        return await asyncio.get_running_loop().run_in_executor(self._executor, call)
+
+    #--------------------------------
+    async def create_table(self, table_name, **options):
+        return await self._run(self.database.create_table, table_name, **options)
+
+    #--------------------------------
+    async def migrate(self, migrations):
+        return await self._run(self.database.migrate, migrations)
+
+    #--------------------------------
+    async def add_to_table(self, table_name, **parameters):
+        return await self._run(self.database.add_to_table, table_name, **parameters)
+
+    #--------------------------------
+    async def add_many(self, table_name, rows, **options):
+        return await self._run(self.database.add_many, table_name, rows, **options)
+
+    #--------------------------------
+    async def select_from_table(self, table_name, select='*', **parameters):
+        return await self._run(self.database.select_from_table, table_name, select, **parameters)
+
+    #--------------------------------
+    async def iter_select(self, table_name, select='*', **parameters):
+        """Return list of rows from iter_select(), rows are fetched in a worker thread."""
+
+        return await self._run(lambda: list(self.database.iter_select(table_name, select, **parameters)))
+
+    #--------------------------------
+    async def update_row(self, table_name, primary_key, **parameters):
+        return await self._run(self.database.update_row, table_name, primary_key, **parameters)
+
+    #--------------------------------
+    async def delete(self, table_name, **parameters):
+        return await self._run(self.database.delete, table_name, **parameters)
+
+    #--------------------------------
+    async def table_version(self, table_name):
+        return await self._run(self.database.table_version, table_name)
+
+    #--------------------------------
+    async def close(self):
+        """Stop worker threads and close connections."""
+
+        self._executor.shutdown(wait=True)
+        self.database.close()
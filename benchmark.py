@@ -0,0 +1,1081 @@
+import os, sys, time, tempfile, threading, random, json, sqlite3, tracemalloc, asyncio, zlib
+import argparse, inspect, platform, subprocess, multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from uuid import uuid4
+
+import requests as http
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+import app as application
+import async_app
+from async_database import AsyncSQLiteDatabase
+import database as database_module
+from admission import RateLimiter, WriteQueue
+import encoding
+import transfer
+from database import SQLiteDatabase, SQLiteReplica
+from models import Song, SongSchema, migrations, songs_table
+
+# Benchmarks send requests of one client as fast as possible, limits are measured by bench_admission()
+application.limiter = RateLimiter()
+
+#================================================================
+def seed_songs(database, count):
+    """Fill table 'songs' with 'count' synthetic songs and return their ids."""
+
+    song_ids = [str(uuid4()) for _ in range(count)]
+
+    with database:
+        database.add_many(
+            table_name='songs',
+            rows=({ 'song_id':  song_id,
+                    'band':     f"Band {nr % 50}",
+                    'album':    f"Album {nr % 500}",
+                    'nr':       nr % 12 + 1,
+                    'title':    f"Title {nr}"   } for nr, song_id in enumerate(song_ids)),
+            key='song_id'
+        )
+
+    return song_ids
+
+#--------------------------------
+def make_database(directory, **options):
+    """Create database with table 'songs' in a fresh file."""
+
+    database = SQLiteDatabase(file=os.path.join(directory, f"{uuid4()}.db"), **options)
+    database.migrate(migrations)
+
+    return database
+
+#--------------------------------
+def requests_per_second(client, urls):
+    """Send GET requests to every url and return number of requests per second."""
+
+    start = time.perf_counter()
+
+    for url in urls:
+        client.get(url)
+
+    return len(urls) / (time.perf_counter() - start)
+
+#--------------------------------
+def latency_stats(latencies, elapsed):
+    """Return number of calls, throughput per second and latency
+    percentiles in milliseconds of calls which took 'elapsed' seconds."""
+
+    latencies   = sorted(latencies)
+    count       = len(latencies)
+
+    def percentile(value):
+        return latencies[min(count - 1, int(count * value / 100))] * 1000
+
+    return {
+        'count':        count,
+        'throughput':   count / elapsed,
+        'mean':         sum(latencies) / count * 1000,
+        'p50':          percentile(50),
+        'p90':          percentile(90),
+        'p99':          percentile(99),
+        'max':          latencies[-1] * 1000
+    }
+
+#--------------------------------
+def timed_calls(function, count):
+    """Call function(index) 'count' times and return latency_stats() of calls."""
+
+    latencies   = []
+    start       = time.perf_counter()
+
+    for index in range(count):
+        call_start = time.perf_counter()
+        function(index)
+        latencies.append(time.perf_counter() - call_start)
+
+    return latency_stats(latencies, time.perf_counter() - start)
+
+#--------------------------------
+@contextmanager
+def serve(wsgi_app, host='127.0.0.1'):
+    """Run WSGI application by werkzeug server on a free local port
+    in a thread and yield its URL."""
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args):
+            pass
+
+    server = make_server(host, 0, wsgi_app, threaded=True, request_handler=QuietHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    try:
+        yield f"http://{host}:{server.server_port}"
+    finally:
+        server.shutdown()
+        thread.join()
+
+#================================================================
+def bench_song_by_id(songs=1000, requests=2000):
+    """Compare GET /songs/<song_id> with a connection opened per request
+    (pool_size=0, behaviour before the pool) and with pooled connections."""
+
+    client  = application.app.test_client()
+    results = {}
+
+    with tempfile.TemporaryDirectory() as directory:
+        for name, pool_size in (('no pool', 0), ('pool', 5)):
+            database                = make_database(directory, pool_size=pool_size)
+            song_ids                = seed_songs(database, songs)
+            application.database    = database
+            application.reader      = database
+            urls                    = [f"/songs/{song_ids[i % songs]}" for i in range(requests)]
+
+            results[name] = requests_per_second(client, urls)
+            database.close()
+
+    return results
+
+#--------------------------------
+def mixed_load(database, song_ids, readers=4, writers=1, duration=2.0):
+    """Run reader and writer threads against database for 'duration' seconds.
+    Return number of successful reads per second and number of failed reads."""
+
+    stop    = threading.Event()
+    reads   = [0] * readers
+    errors  = [0] * readers
+
+    def reader(index):
+        while not stop.is_set():
+            with database:
+                result = database.select_from_table('songs', song_id=random.choice(song_ids))
+
+            if result:
+                reads[index] += 1
+            else:
+                errors[index] += 1
+
+    def writer():
+        while not stop.is_set():
+            with database:
+                database.update_row(
+                    table_name='songs',
+                    primary_key={'name': 'song_id', 'value': random.choice(song_ids)},
+                    title=str(uuid4())
+                )
+
+    threads = [threading.Thread(target=reader, args=(i,)) for i in range(readers)]
+    threads += [threading.Thread(target=writer) for _ in range(writers)]
+
+    for thread in threads:
+        thread.start()
+
+    time.sleep(duration)
+    stop.set()
+
+    for thread in threads:
+        thread.join()
+
+    return sum(reads) / duration, sum(errors)
+
+#--------------------------------
+def bench_mixed_load(songs=1000, duration=2.0):
+    """Compare reader throughput with and without a writer for SQLite default
+    pragmas (rollback journal, full sync) and for the tuned profile (WAL)."""
+
+    profiles = {
+        'default':  dict(journal_mode='delete', synchronous='full', mmap_size=None,
+                         cache_size=None, busy_timeout=None),
+        'tuned':    dict()
+    }
+    results = {}
+
+    with tempfile.TemporaryDirectory() as directory:
+        for name, pragmas in profiles.items():
+            database    = make_database(directory, **pragmas)
+            song_ids    = seed_songs(database, songs)
+
+            for writers in (0, 1):
+                results[f"{name}, {writers} writer"] = mixed_load(
+                    database, song_ids, writers=writers, duration=duration
+                )
+
+            database.close()
+
+    return results
+
+#--------------------------------
+def legacy_select(connection, table_name):
+    """select_from_table before row materialization layer: sqlite3.Row,
+    then a json.dumps/json.loads round-trip to get plain dicts."""
+
+    connection.row_factory  = sqlite3.Row
+    result                  = connection.execute(f"SELECT * FROM {table_name}").fetchall()
+    result                  = json.dumps([dict(row) for row in result])
+    connection.row_factory  = None
+
+    return json.loads(result)
+
+#--------------------------------
+def measure(function, *args, **kwargs):
+    """Return time in seconds and peak of allocated memory in bytes of a call."""
+
+    tracemalloc.start()
+    start   = time.perf_counter()
+    function(*args, **kwargs)
+    elapsed = time.perf_counter() - start
+    peak    = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return elapsed, peak
+
+#--------------------------------
+def bench_select(sizes=(10_000, 100_000, 1_000_000)):
+    """Compare legacy select with select_from_table returning dicts and tuples
+    for tables of given sizes."""
+
+    results = {}
+
+    with tempfile.TemporaryDirectory() as directory:
+        for size in sizes:
+            database = make_database(directory)
+
+            with database:
+                database.connection.executemany(
+                    "INSERT INTO songs(song_id, band, album, nr, title) VALUES(?, ?, ?, ?, ?)",
+                    ((str(uuid4()), f"Band {i % 50}", f"Album {i % 500}", i % 12 + 1, f"Title {i}")
+                        for i in range(size))
+                )
+                database.connection.commit()
+
+                results[size] = {
+                    'legacy':   measure(legacy_select, database.connection, 'songs'),
+                    'dict':     measure(database.select_from_table, 'songs'),
+                    'tuple':    measure(database.select_from_table, 'songs', as_tuple=True)
+                }
+
+            database.close()
+
+    return results
+
+#--------------------------------
+def bench_bulk_import(songs=100_000, single=2_000):
+    """Compare rows per second of add_many() with one add_to_table() call per song."""
+
+    def rows(count):
+        return ({   'song_id':  str(uuid4()),
+                    'band':     f"Band {i % 50}",
+                    'album':    f"Album {i % 500}",
+                    'nr':       i % 12 + 1,
+                    'title':    f"Title {i}"    } for i in range(count))
+
+    results = {}
+
+    with tempfile.TemporaryDirectory() as directory:
+        database = make_database(directory)
+
+        with database:
+            start = time.perf_counter()
+
+            for row in rows(single):
+                database.add_to_table('songs', on_conflict='nothing', **row)
+
+            results['add_to_table'] = single / (time.perf_counter() - start)
+
+            start = time.perf_counter()
+            database.add_many('songs', rows(songs), key='song_id', on_conflict='nothing')
+            results['add_many'] = songs / (time.perf_counter() - start)
+
+        database.close()
+
+    return results
+
+#--------------------------------
+def bench_lookup_statements(songs=1000, lookups=50_000):
+    """Compare lookups by song_id per second with SQL built on every call and
+    no statement cache (cached_statements=0) against memoized build_sql()
+    with cached prepared statements."""
+
+    build_sql   = database_module.build_sql
+    results     = {}
+
+    with tempfile.TemporaryDirectory() as directory:
+        for name, cached_statements, builder in (('uncached', 0, build_sql.__wrapped__),
+                                                 ('cached', 256, build_sql)):
+            database                    = make_database(directory, cached_statements=cached_statements)
+            song_ids                    = seed_songs(database, songs)
+            database_module.build_sql   = builder
+
+            try:
+                with database:
+                    start = time.perf_counter()
+
+                    for i in range(lookups):
+                        database.select_from_table('songs', song_id=song_ids[i % songs])
+
+                    results[name] = lookups / (time.perf_counter() - start)
+            finally:
+                database_module.build_sql = build_sql
+
+            database.close()
+
+    return results
+
+#--------------------------------
+async def asgi_get(application, path):
+    """Send GET request to ASGI application in process and return status."""
+
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    await application({'type': 'http', 'method': 'GET', 'path': path, 'query_string': b''}, receive, send)
+
+    return messages[0]['status']
+
+#--------------------------------
+def bench_async(songs=1000, clients=1000, requests_per_client=5, workers=16):
+    """Compare requests per second of GET /songs/<song_id> sent by 'clients'
+    concurrent clients to the Flask app served by 'workers' threads
+    and to the ASGI app from async_app.py."""
+
+    results = {}
+
+    with tempfile.TemporaryDirectory() as directory:
+        database                = make_database(directory, pool_size=workers)
+        song_ids                = seed_songs(database, songs)
+        paths                   = [f"/songs/{random.choice(song_ids)}" for _ in range(clients * requests_per_client)]
+        application.database    = database
+        application.reader      = database
+
+        def flask_client(index):
+            client = application.app.test_client()
+
+            for path in paths[index * requests_per_client:(index + 1) * requests_per_client]:
+                client.get(path)
+
+        start = time.perf_counter()
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(flask_client, range(clients)))
+
+        results['flask'] = len(paths) / (time.perf_counter() - start)
+
+        async def asgi_client(index):
+            for path in paths[index * requests_per_client:(index + 1) * requests_per_client]:
+                await asgi_get(async_app.app, path)
+
+        async def asgi_clients():
+            await asyncio.gather(*[asgi_client(index) for index in range(clients)])
+
+        async_app.database  = AsyncSQLiteDatabase(database, workers=workers)
+        start               = time.perf_counter()
+        asyncio.run(asgi_clients())
+        results['asgi']     = len(paths) / (time.perf_counter() - start)
+
+        async_app.database._executor.shutdown()
+        database.close()
+
+    return results
+
+#--------------------------------
+def bench_serialization(songs=10_000):
+    """Compare songs per second of creating Song from rows and dumping it
+    by SongSchema with Song.from_row() and Song.dump()."""
+
+    rows    = [{'song_id': str(uuid4()), 'band': f"Band {i % 50}", 'album': f"Album {i % 500}",
+                'nr': i % 12 + 1, 'title': f"Title {i}"} for i in range(songs)]
+    payload = [{'band_name': row['band'], 'album_name': row['album'], 'nr': row['nr'],
+                'title': row['title']} for row in rows]
+    schema  = SongSchema()
+    results = {}
+
+    def timed(function):
+        start = time.perf_counter()
+        function()
+        return songs / (time.perf_counter() - start)
+
+    def hydrate_with_new_id():
+        for row in rows:
+            song            = Song(row['band'], row['album'], row['nr'], row['title'])
+            song.song_id    = row['song_id']
+
+    hydrated = [Song.from_row(row) for row in rows]
+
+    results['hydrate with new ID']      = timed(hydrate_with_new_id)
+    results['hydrate Song.from_row']    = timed(lambda: [Song.from_row(row) for row in rows])
+    results['dump SongSchema']          = timed(lambda: [schema.dump(song) for song in hydrated])
+    results['dump SongSchema many']     = timed(lambda: SongSchema(many=True).dump(hydrated))
+    results['dump Song.dump']           = timed(lambda: [song.dump() for song in hydrated])
+    results['load SongSchema']          = timed(lambda: [schema.load(item) for item in payload])
+
+    return results
+
+#--------------------------------
+def bench_group_commit(threads=16, writes=200):
+    """Compare inserts per second sent by 'threads' concurrent threads, each
+    write committed separately and with group commit; return also writer stats."""
+
+    results = {}
+
+    with tempfile.TemporaryDirectory() as directory:
+        for name, group_commit in (('separate', False), ('grouped', True)):
+            database = make_database(directory, synchronous='full', group_commit=group_commit)
+
+            def client(index):
+                with database:
+                    for nr in range(writes):
+                        database.add_to_table(
+                            table_name='songs',
+                            song_id=str(uuid4()),
+                            band=f"Band {index}",
+                            album=f"Album {nr}",
+                            nr=nr % 12 + 1,
+                            title=f"Title {nr}"
+                        )
+
+            start = time.perf_counter()
+
+            with ThreadPoolExecutor(max_workers=threads) as executor:
+                list(executor.map(client, range(threads)))
+
+            results[name] = threads * writes / (time.perf_counter() - start)
+
+            if database.writer:
+                results['writer'] = database.writer.stats
+
+            database.close()
+
+    return results
+
+#--------------------------------
+def bench_compression(songs=10_000, repeat=5):
+    """Compare time of encoding 'songs' rows to JSON by every encoder, size of body
+    and time of gzip on every level, and GET /songs with and without gzip."""
+
+    def timed(function, *args):
+        start = time.perf_counter()
+
+        for _ in range(repeat):
+            result = function(*args)
+
+        return (time.perf_counter() - start) / repeat, result
+
+    results = {}
+
+    with tempfile.TemporaryDirectory() as directory:
+        database = make_database(directory)
+        seed_songs(database, songs)
+
+        with database:
+            rows = database.select_from_table('songs')
+
+        results['encode flask-restx'] = timed(json.dumps, rows)
+
+        for name, dumps in encoding.json_encoders.items():
+            results[f"encode {name}"] = timed(dumps, rows)
+
+        body = encoding.stdlib_dumps(rows).encode()
+
+        for level in (1, 6, 9):
+            elapsed, compressed         = timed(lambda: zlib.compress(body, level))
+            results[f"gzip level {level}"] = elapsed, compressed
+
+        application.database    = database
+
+        application.reader      = database
+        client                  = application.app.test_client()
+
+        for name, headers in (('GET /songs', {}), ('GET /songs gzip', {'Accept-Encoding': 'gzip'})):
+            results[name] = timed(lambda: client.get('/songs', headers=headers).get_data())
+
+        database.close()
+
+    return {name: (elapsed, len(body)) for name, (elapsed, body) in results.items()}
+
+#--------------------------------
+def endpoint_calls(song_ids):
+    """Return calls of every endpoint for bench_endpoints(): name and function
+    which returns method, path and JSON body of request with given index.
+    Songs from the second half of song_ids are modified and removed."""
+
+    half    = len(song_ids) // 2
+    read    = song_ids[:half]
+    written = song_ids[half:]
+
+    def song(index, prefix='Bench'):
+        return {'band_name': f"{prefix} band", 'album_name': f"{prefix} album {index // 12}",
+                'nr': index % 12 + 1, 'title': f"{prefix} {uuid4()}"}
+
+    return [
+        ('GET /songs?limit=100',        lambda i: ('GET', f"/songs?limit=100&after={read[i % half]}", None)),
+        ('GET /songs filtered',         lambda i: ('GET', f"/songs?band=Band {i % 50}&nr_min=2&nr_max=6"
+                                                          f"&order_by=-nr&limit=50", None)),
+        ('GET /songs/search',           lambda i: ('GET', f"/songs/search?q=Title {i}", None)),
+        ('GET /songs/<song_id>',        lambda i: ('GET', f"/songs/{read[i % half]}", None)),
+        ('GET /songs/lookup',           lambda i: ('GET', "/songs/lookup?ids=" + ",".join(
+                                                          read[(i * 20 + j) % half] for j in range(20)), None)),
+        ('POST /songs',                 lambda i: ('POST', "/songs", song(i))),
+        ('POST /songs/bulk',            lambda i: ('POST', "/songs/bulk", [song(j, 'Bulk') for j in range(100)])),
+        ('PUT /songs/<song_id>',        lambda i: ('PUT', f"/songs/{written[i % len(written)]}", song(i, 'Put'))),
+        ('DELETE /songs/<song_id>',     lambda i: ('DELETE', f"/songs/{written[i % len(written)]}", None)),
+        ('GET /cache',                  lambda i: ('GET', "/cache", None))
+    ]
+
+#--------------------------------
+def bench_endpoints(songs=10_000, requests=200):
+    """Send 'requests' requests to every endpoint of the app with 'songs' synthetic
+    songs by Flask test client and by HTTP to a local werkzeug server.
+    Return latency_stats() of every endpoint for both clients."""
+
+    results = {}
+
+    with tempfile.TemporaryDirectory() as directory:
+        for client_name in ('test client', 'server'):
+            database                = make_database(directory)
+            song_ids                = seed_songs(database, max(songs, 2 * requests))
+            application.database    = database
+            application.reader      = database
+            application.song_cache.clear()
+
+            with serve(application.app) as url:
+                session = http.Session()
+                client  = application.app.test_client()
+
+                def send(method, path, body):
+                    if client_name == 'server':
+                        response = session.request(method, url + path, json=body)
+                        status   = response.status_code
+                    else:
+                        response = client.open(path, method=method, json=body)
+                        status   = response.status_code
+                        response.close()
+
+                    assert status < 500, f"{method} {path}: {status}"
+
+                for name, call in endpoint_calls(song_ids):
+                    results[f"{client_name} {name}"] = timed_calls(lambda i: send(*call(i)), requests)
+
+            database.close()
+
+    return results
+
+#--------------------------------
+def bench_database_methods(songs=10_000, calls=1000):
+    """Call every method of SQLiteDatabase 'calls' times on a table with
+    'songs' synthetic songs and return latency_stats() of every method."""
+
+    results = {}
+
+    with tempfile.TemporaryDirectory() as directory:
+        database    = make_database(directory)
+        song_ids    = seed_songs(database, max(songs, 2 * calls))
+        half        = len(song_ids) // 2
+
+        def row(index):
+            return {'song_id': str(uuid4()), 'band': "Bench band", 'album': f"Bench album {index}",
+                    'nr': index % 12 + 1, 'title': f"Bench {uuid4()}"}
+
+        methods = {
+            'select_from_table by id':  lambda i: database.select_from_table('songs', song_id=song_ids[i % half]),
+            'select_from_table filter': lambda i: database.select_from_table(
+                                            'songs', band=f"Band {i % 50}", nr__ge=2, order_by='nr', limit=50),
+            'select_in 100 ids':        lambda i: database.select_in(
+                                            'songs', 'song_id', song_ids[i % half:i % half + 100]),
+            'iter_select page 100':     lambda i: list(database.iter_select(
+                                            'songs', order_by='song_id', after=song_ids[i % half], limit=100)),
+            'search':                   lambda i: database.search('songs', f"Title {i}"),
+            'table_version':            lambda i: database.table_version('songs'),
+            'add_to_table':             lambda i: database.add_to_table('songs', **row(i)),
+            'add_many 100 rows':        lambda i: database.add_many(
+                                            'songs', [row(i * 100 + j) for j in range(100)], key='song_id'),
+            'update_row':               lambda i: database.update_row(
+                                            'songs', {'name': 'song_id', 'value': song_ids[half + i]},
+                                            title=f"Updated {uuid4()}"),
+            'delete':                   lambda i: database.delete('songs', song_id=song_ids[half + i])
+        }
+
+        with database:
+            for name, method in methods.items():
+                results[name] = timed_calls(method, calls // 10 if 'many' in name else calls)
+
+        database.close()
+
+    return results
+
+#--------------------------------
+def bench_instrumentation(songs=1000, requests=2000, calls=100_000):
+    """Compare requests per second of GET /songs/<song_id> with profiler off
+    and profiling every 100th and every request, and return time in microseconds
+    of metrics of one request (start_request, query_hook and finish_request)."""
+
+    metrics = application.metrics
+    results = {}
+
+    with tempfile.TemporaryDirectory() as directory:
+        database                = make_database(directory)
+        song_ids                = seed_songs(database, songs)
+        client                  = application.app.test_client()
+        urls                    = [f"/songs/{song_ids[i % songs]}" for i in range(requests)]
+        application.database    = database
+        application.reader      = database
+        database.query_hooks.append(metrics.query_hook)
+
+        for every in (0, 100, 1):
+            application.profiler.every  = every
+            results[f"profile every {every}" if every else "profiler off"] = requests_per_second(client, urls)
+
+        application.profiler.every = 0
+        database.close()
+
+    start = time.perf_counter()
+
+    for _ in range(calls):
+        metrics.start_request()
+        metrics.query_hook('SELECT', (), 0.0001, 1)
+        metrics.finish_request('GET', '/benchmark', 200)
+
+    results['metrics per request us'] = (time.perf_counter() - start) / calls * 1_000_000
+
+    return results
+
+#--------------------------------
+startup_script = """
+import json, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+app.app.test_client().get('/songs/unknown')
+print(json.dumps({'import app': imported - start, 'first request': time.perf_counter() - imported}))
+"""
+
+#--------------------------------
+def legacy_startup(database):
+    """Startup before create_app(): CREATE TABLE and load of the whole table on import."""
+
+    with database:
+        database.create_table(**songs_table)
+        database.select_from_table('songs')
+
+#--------------------------------
+def bench_startup(songs=100_000):
+    """Return time in seconds of import of app and of its first request (with migrations)
+    in a new process with 'songs' songs in database, and time and peak memory
+    of the eager load done on import before."""
+
+    with tempfile.TemporaryDirectory() as directory:
+        database = make_database(directory)
+        seed_songs(database, songs)
+        database.close()
+
+        environment = {**os.environ, 'SONGS_DATABASE': database.file}
+        output      = subprocess.run([sys.executable, '-c', startup_script], env=environment, check=True,
+                                     cwd=os.path.dirname(os.path.abspath(__file__)),
+                                     capture_output=True, text=True).stdout
+        results     = json.loads(output.splitlines()[-1])
+
+        database = SQLiteDatabase(file=database.file)
+        results['legacy eager load'], results['legacy eager load peak bytes'] = measure(legacy_startup, database)
+        database.close()
+
+    return results
+
+#--------------------------------
+def replica_reader(file, song_ids, max_staleness, duration, start, results):
+    """Process which reads songs by ID from file or its replica and puts number of reads to results."""
+
+    database    = SQLiteDatabase(file=file)
+    reader      = SQLiteReplica(database, max_staleness=max_staleness) if max_staleness is not None else database
+    reads       = 0
+
+    start.wait()
+    stop = time.perf_counter() + duration
+
+    while time.perf_counter() < stop:
+        with reader:
+            reader.select_from_table('songs', song_id=random.choice(song_ids))
+
+        reads += 1
+
+    results.put(reads)
+    reader.close()
+    database.close()
+
+#--------------------------------
+def replica_writer(file, song_ids, duration, start):
+    """Process which updates titles of songs in file for 'duration' seconds."""
+
+    database = SQLiteDatabase(file=file)
+
+    start.wait()
+    stop = time.perf_counter() + duration
+
+    while time.perf_counter() < stop:
+        with database:
+            database.update_row(
+                table_name='songs',
+                primary_key={'name': 'song_id', 'value': random.choice(song_ids)},
+                title=str(uuid4())
+            )
+
+    database.close()
+
+#--------------------------------
+def bench_replicas(songs=10_000, processes=(1, 2, 4), max_staleness=0.5, duration=2.0):
+    """Compare reads per second of 'processes' reader processes, which read from
+    database file or from own replica, while one writer process updates songs."""
+
+    context = multiprocessing.get_context('spawn')
+    results = {}
+
+    with tempfile.TemporaryDirectory() as directory:
+        database = make_database(directory)
+        song_ids = seed_songs(database, songs)
+        database.close()
+
+        for name, staleness in (('primary', None), ('replica', max_staleness)):
+            for count in processes:
+                start   = context.Barrier(count + 1)
+                reads   = context.Queue()
+                workers = [context.Process(target=replica_reader,
+                                           args=(database.file, song_ids, staleness, duration, start, reads))
+                           for _ in range(count)]
+                workers.append(context.Process(target=replica_writer, args=(database.file, song_ids, duration, start)))
+
+                for worker in workers:
+                    worker.start()
+
+                results[f"{name}, {count} readers"] = sum(reads.get() for _ in range(count)) / duration
+
+                for worker in workers:
+                    worker.join()
+
+    return results
+
+#--------------------------------
+def bench_changes(songs=10_000, changed=100, repeat=10):
+    """Compare sync of a mirror after 'changed' updates by full GET /songs and
+    by GET /songs/changes (time in seconds and bytes), and rows per second
+    of add_many() to table with and without log of changes."""
+
+    results = {}
+
+    with tempfile.TemporaryDirectory() as directory:
+        database                = make_database(directory)
+        song_ids                = seed_songs(database, songs)
+        client                  = application.app.test_client()
+        application.database    = database
+        application.reader      = database
+
+        since = client.get('/songs/changes').get_json()['last']
+
+        with database:
+            for song_id in song_ids[:changed]:
+                database.update_row('songs', {'name': 'song_id', 'value': song_id}, title=str(uuid4()))
+
+        for name, url in (('full GET /songs', '/songs'), ('GET /songs/changes', f"/songs/changes?since={since}&limit=1000")):
+            start   = time.perf_counter()
+            sizes   = [len(client.get(url).get_data()) for _ in range(repeat)]
+            results[name] = {'seconds': (time.perf_counter() - start) / repeat, 'bytes': sizes[-1]}
+
+        database.close()
+
+        rows = [{'song_id': str(uuid4()), 'band': f"Band {i % 50}", 'album': f"Album {i % 500}",
+                 'nr': i % 12 + 1, 'title': f"Title {i}"} for i in range(songs)]
+
+        for name, changes in (('add_many without change log', False), ('add_many with change log', True)):
+            database = SQLiteDatabase(file=os.path.join(directory, f"{uuid4()}.db"))
+
+            with database:
+                database.create_table(**{**songs_table, 'changes': changes})
+                start = time.perf_counter()
+                database.add_many('songs', rows, key='song_id')
+                results[name] = songs / (time.perf_counter() - start)
+
+            database.close()
+
+    return results
+
+#--------------------------------
+def bench_transfer(songs=100_000):
+    """Rows per second of export and import of table by transfer.py and size of file
+    in bytes for every format."""
+
+    results = {}
+
+    with tempfile.TemporaryDirectory() as directory:
+        database = make_database(directory)
+        seed_songs(database, songs)
+
+        for file_format in transfer.writers:
+            file = os.path.join(directory, f"songs.{file_format}")
+
+            with open(file, 'w', encoding='utf-8', newline='') as stream:
+                start   = time.perf_counter()
+                count   = transfer.export_table(database, stream, file_format)
+                export  = count / (time.perf_counter() - start)
+
+            target = make_database(directory)
+
+            with open(file, encoding='utf-8', newline='') as stream:
+                start       = time.perf_counter()
+                count, _    = transfer.import_table(target, stream, file_format)
+                results[file_format] = {'export': export, 'import': count / (time.perf_counter() - start),
+                                        'bytes': os.path.getsize(file)}
+
+            target.close()
+
+        database.close()
+
+    return results
+
+#--------------------------------
+def bench_admission(songs=1000, duration=10.0, flooders=4):
+    """Compare latency of reads of one client while other clients post songs
+    in a tight loop, without limits and with rate limits and write queue of app.py,
+    with numbers of added and rejected songs and rejected reads."""
+
+    configurations = {
+        'no limits':    (RateLimiter(), WriteQueue(max_in_flight=1_000)),
+        'limits':       (RateLimiter(read=(200, 400), write=(20, 100)), WriteQueue())
+    }
+    results = {}
+
+    with tempfile.TemporaryDirectory() as directory:
+        database                    = make_database(directory)
+        song_ids                    = seed_songs(database, songs)
+        application.database        = database
+        application.reader          = database
+        application.client_header   = 'X-Client-ID'
+
+        for name, (limiter, write_queue) in configurations.items():
+            application.limiter     = limiter
+            application.write_queue = write_queue
+            stop                    = threading.Event()
+            statuses                = []
+
+            with serve(application.app) as url:
+                def flood(index):
+                    session = http.Session()
+
+                    while not stop.is_set():
+                        song = {'band_name': f"Flood {index}", 'album_name': "Flood", 'nr': 1, 'title': str(uuid4())}
+                        statuses.append(session.post(f"{url}/songs", json=song,
+                                                     headers={'X-Client-ID': f"flooder {index}"}).status_code)
+
+                threads = [threading.Thread(target=flood, args=(index,)) for index in range(flooders)]
+
+                for thread in threads:
+                    thread.start()
+
+                session     = http.Session()
+                latencies   = []
+                rejected    = 0
+                start       = time.perf_counter()
+
+                while time.perf_counter() - start < duration:
+                    call_start  = time.perf_counter()
+                    response    = session.get(f"{url}/songs", params={'limit': 20, 'after': random.choice(song_ids)},
+                                              headers={'X-Client-ID': 'reader'})
+                    latencies.append(time.perf_counter() - call_start)
+                    rejected    += response.status_code == 429
+
+                elapsed = time.perf_counter() - start
+                stop.set()
+
+                for thread in threads:
+                    thread.join()
+
+            results[name] = {**latency_stats(latencies, elapsed),
+                             'added': statuses.count(201), 'rejected': statuses.count(429),
+                             'rejected reads': rejected}
+
+        database.close()
+
+    application.limiter         = RateLimiter()
+    application.write_queue     = WriteQueue()
+    application.client_header   = None
+
+    return results
+
+#--------------------------------
+def bench_summaries(songs=10_000, repeat=20, bands=10):
+    """Compare band and album pages built from full GET /songs by client with
+    GET /bands/<band>/albums and /albums/<album>/songs from summary tables
+    (time in seconds and bytes), and rows per second of add_many() to table
+    with and without summaries, also with all songs in a few 'bands' of many albums."""
+
+    def group_songs(songs):
+        albums = {}
+
+        for song in songs:
+            albums.setdefault((song['band'], song['album']), []).append(song)
+
+        return {key: sorted(tracks, key=lambda song: song['nr']) for key, tracks in albums.items()}
+
+    results = {}
+
+    with tempfile.TemporaryDirectory() as directory:
+        database                = make_database(directory)
+        seed_songs(database, songs)
+        client                  = application.app.test_client()
+        application.database    = database
+        application.reader      = database
+
+        for name, urls in (('full GET /songs', ['/songs']),
+                           ('summaries', ['/bands/Band 1/albums', '/albums/Album 1/songs?band=Band 1'])):
+            start = time.perf_counter()
+
+            for _ in range(repeat):
+                responses = [client.get(url) for url in urls]
+
+                if name == 'full GET /songs':
+                    group_songs(responses[0].get_json())
+
+            results[name] = {'seconds': (time.perf_counter() - start) / repeat,
+                             'bytes': sum(len(response.get_data()) for response in responses)}
+
+        database.close()
+
+        # Summaries recompute album of every added song, so albums have 12 songs like real ones,
+        # not songs/500 like seed_songs(); bands have 10 albums, or many albums if there are few bands
+        def make_rows(band_of):
+            return [{'song_id': str(uuid4()), 'band': f"Band {band_of(i // 12)}", 'album': f"Album {i // 12}",
+                     'nr': i % 12 + 1, 'title': f"Title {i}"} for i in range(songs)]
+
+        for name, count, band_of in (('add_many without summaries', 2, lambda album: album // 10),
+                                     ('add_many with summaries', len(migrations), lambda album: album // 10),
+                                     (f"add_many with summaries, {songs // 12 // bands} albums per band",
+                                      len(migrations), lambda album: album % bands)):
+            database    = SQLiteDatabase(file=os.path.join(directory, f"{uuid4()}.db"))
+            rows        = make_rows(band_of)
+            database.migrate(migrations[:count])
+
+            with database:
+                start = time.perf_counter()
+                database.add_many('songs', rows, key='song_id')
+                results[name] = songs / (time.perf_counter() - start)
+
+            database.close()
+
+    return results
+
+#================================================================
+benchmarks = {
+    'endpoints':        bench_endpoints,
+    'database':         bench_database_methods,
+    'song_by_id':       bench_song_by_id,
+    'mixed_load':       bench_mixed_load,
+    'select':           bench_select,
+    'bulk_import':      bench_bulk_import,
+    'lookup':           bench_lookup_statements,
+    'async':            bench_async,
+    'serialization':    bench_serialization,
+    'group_commit':     bench_group_commit,
+    'compression':      bench_compression,
+    'instrumentation':  bench_instrumentation,
+    'startup':          bench_startup,
+    'replicas':         bench_replicas,
+    'changes':          bench_changes,
+    'transfer':         bench_transfer,
+    'admission':        bench_admission,
+    'summaries':        bench_summaries
+}
+
+#--------------------------------
+def git_commit():
+    """Return hash of current commit of repository or None."""
+
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+#--------------------------------
+def run(names, **options):
+    """Run benchmarks and return report with their results.
+    Options (songs, requests, calls) are passed to benchmarks which have such parameters,
+    None leaves default value of benchmark."""
+
+    report = {
+        'commit':   git_commit(),
+        'python':   platform.python_version(),
+        'sqlite':   sqlite3.sqlite_version,
+        'time':     time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'options':  options,
+        'results':  {}
+    }
+
+    for name in names:
+        function    = benchmarks[name]
+        parameters  = inspect.signature(function).parameters
+        arguments   = {key: value for key, value in options.items() if value is not None and key in parameters}
+
+        report['results'][name] = function(**arguments)
+
+    return report
+
+#--------------------------------
+def flatten(results, prefix=''):
+    """Return numbers from nested results with keys joined by ' / '."""
+
+    values = {}
+
+    if isinstance(results, dict):
+        items = results.items()
+    elif isinstance(results, (list, tuple)):
+        items = enumerate(results)
+    else:
+        return {prefix: results} if isinstance(results, (int, float)) else {}
+
+    for key, value in items:
+        values.update(flatten(value, f"{prefix} / {key}" if prefix else str(key)))
+
+    return values
+
+#--------------------------------
+def compare(old, new):
+    """Print values of two reports with change of every value in percent."""
+
+    old, new = flatten(old['results']), flatten(new['results'])
+
+    for key in new:
+        if key in old:
+            change = (new[key] - old[key]) / old[key] * 100 if old[key] else 0
+            print(f"{key:<70} {old[key]:14.3f} {new[key]:14.3f} {change:+8.1f}%")
+
+#================================================================
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmarks of songs API, results are saved as JSON.")
+    parser.add_argument('names', nargs='*', choices=[[], *benchmarks], default=[], metavar='NAME',
+                        help=f"benchmarks to run ({', '.join(benchmarks)}), all by default")
+    parser.add_argument('--songs', type=int, help="number of synthetic songs in database")
+    parser.add_argument('--requests', type=int, help="number of requests sent to every endpoint")
+    parser.add_argument('--calls', type=int, help="number of calls of every database method")
+    parser.add_argument('--output', help="file for JSON report, e.g. results/<commit>.json")
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help="compare two JSON reports")
+    arguments = parser.parse_args()
+
+    if arguments.compare:
+        reports = []
+
+        for path in arguments.compare:
+            with open(path) as file:
+                reports.append(json.load(file))
+
+        compare(*reports)
+        sys.exit()
+
+    report = run(arguments.names or list(benchmarks), songs=arguments.songs,
+                 requests=arguments.requests, calls=arguments.calls)
+
+    for key, value in flatten(report['results']).items():
+        print(f"{key:<70} {value:14.3f}")
+
+    if arguments.output:
+        with open(arguments.output, 'w') as file:
+            json.dump(report, file, indent=4)
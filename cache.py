@@ -0,0 +1,129 @@
+import sys, time, threading
+from collections import OrderedDict
+
+#================================================================
+def sizeof(value):
+    """Approximate size of object in bytes with its attributes."""
+
+    size = sys.getsizeof(value)
+
+    if hasattr(value, '__dict__'):
+        attributes = vars(value).values()
+    else:
+        attributes = [getattr(value, name, None) for name in getattr(value, '__slots__', ())]
+
+    return size + sum(sys.getsizeof(attribute) for attribute in attributes)
+
+#================================================================
+class LRUCache():
+    """Thread-safe cache which removes least recently used values.
+    Optional:
+        max_size    - maximal number of values
+        max_bytes   - maximal size of all values in bytes, counted by 'sizeof'
+        ttl         - time in seconds after which a value expires, None for no expiry
+        sizeof      - function which returns size of a value in bytes"""
+
+    def __init__(self, max_size=1024, *, max_bytes=None, ttl=None, sizeof=sizeof):
+        self.max_size   = max_size
+        self.max_bytes  = max_bytes
+        self.ttl        = ttl
+        self.sizeof     = sizeof
+        self.hits       = 0
+        self.misses     = 0
+        self.evictions  = 0
+        self.version    = 0         # number of invalidations, see set()
+        self.bytes      = 0
+        self._values    = OrderedDict()
+        self._lock      = threading.Lock()
+
+    #--------------------------------
+    def __repr__(self):
+        return f"LRU cache with {len(self._values)}/{self.max_size} values"
+
+    #--------------------------------
+    def __len__(self):
+        return len(self._values)
+
+    #--------------------------------
+    def get(self, key, default=None):
+        """Return value of key or default if key is not in cache or is expired."""
+
+        with self._lock:
+            item = self._values.get(key)
+
+            if item and item[1] is not None and item[1] < time.monotonic():
+                self._remove(key)
+                item = None
+
+            if not item:
+                self.misses += 1
+                return default
+
+            self._values.move_to_end(key)
+            self.hits += 1
+
+            return item[0]
+
+    #--------------------------------
+    def set(self, key, value, version=None):
+        """Put value to cache and evict least recently used values above limits.
+        Optional:
+            version - cache.version read before value was loaded, value is not put
+                      if anything was invalidated since then, because it can be
+                      older than the change which was invalidated"""
+
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        size    = self.sizeof(value) if self.max_bytes is not None else 0
+
+        with self._lock:
+            if version is not None and version != self.version:
+                return
+
+            if key in self._values:
+                self._remove(key)
+
+            self._values[key]   = (value, expires, size)
+            self.bytes          += size
+
+            while len(self._values) > self.max_size or \
+                    (self.max_bytes is not None and self.bytes > self.max_bytes):
+                self._remove(next(iter(self._values)))
+                self.evictions += 1
+
+    #--------------------------------
+    def invalidate(self, key):
+        """Remove key from cache."""
+
+        with self._lock:
+            self.version += 1
+
+            if key in self._values:
+                self._remove(key)
+
+    #--------------------------------
+    def clear(self):
+        """Remove all values from cache."""
+
+        with self._lock:
+            self._values.clear()
+            self.version    += 1
+            self.bytes      = 0
+
+    #--------------------------------
+    def _remove(self, key):
+        self.bytes -= self._values.pop(key)[2]
+
+    #--------------------------------
+    @property
+    def stats(self):
+        """Counters of cache."""
+
+        return {
+            'hits':         self.hits,
+            'misses':       self.misses,
+            'evictions':    self.evictions,
+            'size':         len(self._values),
+            'max_size':     self.max_size,
+            'bytes':        self.bytes,
+            'max_bytes':    self.max_bytes
+        }
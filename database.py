@@ -1,10 +1,168 @@
-import sqlite3, sys, json
+import os, re, sqlite3, time, pathlib, tempfile, threading, queue, itertools, logging, functools, weakref
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+# Operators of conditions, used as suffix of parameter name, e.g. nr__ge=3
+operators = {'eq': '=', 'ne': '!=', 'lt': '<', 'le': '<=', 'gt': '>', 'ge': '>=', 'in': 'IN'}
+
+#================================================================
+def split_conditions(parameters):
+    """Return conditions for build_sql() and their values from parameters.
+    Name of parameter is a column, optionally with suffix of operator
+    from 'operators' (e.g. nr__ge=3), 'in' takes a sequence of values."""
+
+    conditions  = []
+    values      = []
+
+    for name, value in parameters.items():
+        column, _, operator = name.partition('__')
+        operator            = operator or 'eq'
+
+        if operator not in operators:
+            raise TypeError(f"Unknown operator of parameter '{name}'")
+
+        if operator == 'in':
+            value = tuple(value)
+            conditions.append((column, operator, len(value)))
+            values.extend(value)
+        else:
+            conditions.append((column, operator, 1))
+            values.append(value)
+
+    return tuple(conditions), values
+
+#--------------------------------
+@functools.lru_cache(maxsize=512)
+def build_sql(operation, table_name, columns=(), conditions=(), *, select='*', key=None,
+              on_conflict=None, order_by=None, after=False, limit=False, offset=False):
+    """Return SQL statement, always the same text for the same arguments,
+    so it is built once and sqlite3 reuses its prepared statement.
+    Requirement:
+        operation   - 'insert', 'select', 'update' or 'delete'
+        table_name  - name of a table
+
+    Optional:
+        columns     - tuple of columns set by insert or update
+        conditions  - tuple of columns compared with parameters by '=' in WHERE
+                      or tuples (column, operator, number of values) from split_conditions()
+        select      - columns returned by select
+        key         - column which selects row of update
+        on_conflict - action of insert which breaks an unique constraint
+        order_by    - ORDER BY clause of select
+        after       - select only rows with 'order_by' column greater than parameter
+        limit       - select has LIMIT parameter
+        offset      - select has OFFSET parameter"""
+
+    where = []
+
+    for condition in conditions:
+        column, operator, size = (condition, 'eq', 1) if isinstance(condition, str) else condition
+
+        if operator == 'in':
+            where.append(f"{column} IN ({', '.join('?' * size)})")
+        else:
+            where.append(f"{column} {operators[operator]} ?")
+
+    if operation == 'insert':
+        script = f"INSERT INTO {table_name}({', '.join(columns)}) VALUES({', '.join('?' * len(columns))})"
+
+        if on_conflict:
+            script += f" ON CONFLICT DO {on_conflict.upper()}"
+
+        return script
+
+    if operation == 'select':
+        script = f"SELECT {select} FROM {table_name}"
+
+        if after:
+            where.append(f"{order_by} > ?")
+    elif operation == 'update':
+        script = f"UPDATE {table_name} SET {', '.join(f'{name} = ?' for name in columns)}"
+        where.append(f"{key} = ?")
+    elif operation == 'delete':
+        script = f"DELETE FROM {table_name}"
+    else:
+        raise ValueError(f"Unknown operation: {operation}")
+
+    if where:
+        script += " WHERE " + " AND ".join(where)
+
+    if order_by:
+        script += f" ORDER BY {order_by}"
+
+    if limit:
+        script += " LIMIT ?"
+    elif offset:
+        script += " LIMIT -1"
+
+    if offset:
+        script += " OFFSET ?"
+
+    return script
+
+#--------------------------------
+def grouped(method):
+    """Decorator of write methods of SQLiteDatabase, with group commit enabled
+    the method is executed by the writer thread and caller waits for its commit."""
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self.writer and not self.writer.is_current():
+            return self.writer.submit(method, self, *args, **kwargs)
+
+        return method(self, *args, **kwargs)
+
+    return wrapper
 
 #================================================================
 class SQLiteDatabase():
-    def __init__(self, file=None):
-        self.connection = False
-        self.cursor     = None
+    """Access to SQLite database.
+    Optional:
+        file            - path to database file, database is in memory if empty
+        pool_size       - number of idle connections kept open, 0 disables the pool
+        journal_mode, synchronous, mmap_size, cache_size, busy_timeout
+                        - pragmas applied on every new connection,
+                          None leaves SQLite default value
+        cached_statements
+                        - number of prepared statements cached by every connection
+        slow_query_threshold
+                        - time in seconds, slower statements are logged as warnings
+        group_commit    - execute writes of all threads in one writer thread,
+                          which commits them together (see GroupCommitWriter)
+        group_commit_size, group_commit_delay
+                        - maximal number of writes and time in seconds
+                          waited for them before commit of a group
+
+    Statements are logged by logger 'database' at DEBUG level with their time
+    and number of rows. Functions in 'query_hooks' are called after every statement
+    with arguments: script, parameters, duration in seconds and number of rows."""
+
+    def __init__(self, file=None, pool_size=5, *, journal_mode='wal', synchronous='normal',
+                 mmap_size=64*1024*1024, cache_size=-16000, busy_timeout=5000,
+                 cached_statements=256, slow_query_threshold=None,
+                 group_commit=False, group_commit_size=100, group_commit_delay=0):
+        self.pool_size              = pool_size
+        self.cached_statements      = cached_statements
+        self.slow_query_threshold   = slow_query_threshold
+        self.query_hooks            = []
+        self.schema_version         = None
+        self.replicas               = weakref.WeakSet()
+        self._migration_lock        = threading.Lock()
+        self._pool                  = queue.LifoQueue(maxsize=pool_size) if pool_size else None
+        self._local                 = threading.local()
+        self.pragmas                = {
+            'journal_mode': journal_mode,
+            'synchronous':  synchronous,
+            'mmap_size':    mmap_size,
+            'cache_size':   cache_size,
+            'busy_timeout': busy_timeout
+        }
+
+        if group_commit:
+            self.writer = GroupCommitWriter(self, group_commit_size, group_commit_delay)
+        else:
+            self.writer = None
 
         if file:
             self.file = file
@@ -13,47 +171,222 @@ class SQLiteDatabase():
 
     #--------------------------------
     def __del__(self):
-        if self.connection:
-            self.connection.close()
-            self.cursor = None
+        self.close()
 
     #--------------------------------
     def __repr__(self):
         return f"SQLite database in {self.file}"
 
+    #--------------------------------
+    def __enter__(self):
+        self.connect()
+        return self
+
+    #--------------------------------
+    def __exit__(self, *exc_info):
+        self.disconnect()
+
+    #--------------------------------
+    @property
+    def connection(self):
+        """Connection used by the current thread."""
+
+        return getattr(self._local, 'connection', False)
+
+    @connection.setter
+    def connection(self, value):
+        self._local.connection = value
+
+    #--------------------------------
+    @property
+    def cursor(self):
+        """Cursor of the connection used by the current thread."""
+
+        return getattr(self._local, 'cursor', None)
+
+    @cursor.setter
+    def cursor(self, value):
+        self._local.cursor = value
+
+    #--------------------------------
+    def _open(self):
+        """Open a new connection to the database file and apply pragmas.
+        Pragmas with value None are left with SQLite defaults."""
+
+        connection = sqlite3.connect(self.file, check_same_thread=False,
+                                     cached_statements=self.cached_statements)
+
+        for name, value in self.pragmas.items():
+            if value is not None:
+                connection.execute(f"PRAGMA {name} = {value}")
+
+        return connection
+
     #--------------------------------
     def connect(self):
-        """Activate connection with database."""
+        """Activate connection with database.
+        Every thread gets its own connection, taken from the pool of idle
+        connections when there is one. Calls can be nested, only the outermost
+        disconnect() gives the connection back to the pool."""
 
-        try:
-            print("Connection to SQLite database...", end=' ')
-            self.connection             = sqlite3.connect(self.file)
-            self.connection.row_factory = sqlite3.Row
-            self.cursor                 = self.connection.cursor()
-        except sys.exc_info()[0] as error:
-            print('Error:', error)
-        else:
-            print("Connected!\n")
-        finally:
+        if self.connection:
+            self._local.depth += 1
             return self.connection
 
+        try:
+            try:
+                connection = self._pool.get_nowait()
+            except (AttributeError, queue.Empty):
+                logger.debug("Open connection to %s", self.file)
+                connection = self._open()
+
+            self.connection     = connection
+            self.cursor         = connection.cursor()
+            self._local.depth   = 1
+        except sqlite3.Error as error:
+            logger.error("Connection to %s failed: %s", self.file, error)
+
+        return self.connection
+
     #--------------------------------
     def disconnect(self):
-        """Deactivate connection with database."""
+        """Deactivate connection with database.
+        Connection is returned to the pool and stays open, it is closed
+        only when the pool is full or disabled (pool_size=0)."""
+
+        if not self.connection:
+            return
+
+        self._local.depth -= 1
+
+        if self._local.depth:
+            return
+
+        connection      = self.connection
+        self.connection = False
+        self.cursor     = None
+
+        if connection.in_transaction:
+            connection.rollback()
+
+        try:
+            self._pool.put_nowait(connection)
+        except (AttributeError, queue.Full):
+            connection.close()
+
+    #--------------------------------
+    def close(self):
+        """Close connection of the current thread and all idle connections in the pool.
+        Writer thread of group commit is stopped."""
+
+        if getattr(self, 'writer', None):
+            self.writer.stop()
 
         if self.connection:
-            print("Disconnected with database")
             self.connection.close()
-            self.cursor = None
-    
+            self.connection = False
+            self.cursor     = None
+
+        while self._pool is not None:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                break
+
+    #--------------------------------
+    def _commit(self):
+        """Commit transaction, unless write is a part of group commit."""
+
+        if not getattr(self._local, 'grouped', False):
+            self.connection.commit()
+            self._notify_replicas()
+
+    #--------------------------------
+    def _notify_replicas(self):
+        """Tell replicas about a commit, they read from primary until their next refresh,
+        so a process reads its own writes."""
+
+        for replica in self.replicas:
+            replica.written()
+
+    #--------------------------------
+    def _rollback(self):
+        """Rollback transaction or only the current write of group commit."""
+
+        if getattr(self._local, 'grouped', False):
+            self.connection.execute("ROLLBACK TO write")
+        else:
+            self.connection.rollback()
+
+    #--------------------------------
+    def _execute(self, script, values=(), *, cursor=None, many=False, as_script=False, fetch=False):
+        """Execute script on cursor (cursor of the current thread by default) and report it.
+        Optional:
+            values      - parameters of script, with 'many' list of parameters
+            many        - use executemany()
+            as_script   - use executescript() for many statements without parameters
+            fetch       - fetch and return all rows instead of cursor"""
+
+        cursor  = cursor or self.cursor
+        start   = time.perf_counter()
+
+        if as_script:
+            cursor.executescript(script)
+        elif many:
+            cursor.executemany(script, values)
+        else:
+            cursor.execute(script, values)
+
+        result = cursor.fetchall() if fetch else cursor
+        self._report(script, values, time.perf_counter() - start, len(result) if fetch else cursor.rowcount)
+
+        return result
+
+    #--------------------------------
+    def _report(self, script, values, duration, rows):
+        """Log executed statement and pass it to query hooks."""
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Executed in %.3f ms (%d rows): %s with parameters %s",
+                         duration * 1000, rows, script.strip(), values)
+
+        if self.slow_query_threshold is not None and duration >= self.slow_query_threshold:
+            logger.warning("Slow query %.3f ms (%d rows): %s", duration * 1000, rows, script.strip())
+
+        for hook in self.query_hooks:
+            hook(script, values, duration, rows)
+
+    #--------------------------------
+    @staticmethod
+    def _materialize(cursor, rows, as_tuple=False):
+        """Convert rows fetched by cursor to dicts of column names and values.
+        Names of columns are read from cursor once for all rows.
+        With 'as_tuple' rows are returned as plain tuples."""
+
+        if as_tuple:
+            return rows
+
+        names = [column[0] for column in cursor.description]
+
+        return [dict(zip(names, row)) for row in rows]
+
     #--------------------------------
-    def create_table(self, table_name, *, primary_key='id', **columns):
+    def create_table(self, table_name, *, primary_key='id', indexes=(), unique=(), search=(), changes=False,
+                     raise_errors=False, **columns):
         """Create a table in database.
         Requirement:
             table_name  - name of a table
 
         Optional:
             primary_key - column who has primary key
+            indexes     - tuples of columns, for each one an index is created
+            unique      - tuples of columns, for each one an unique index is created
+            search      - columns of full-text search index (FTS5 table '<table_name>_search'),
+                          kept in sync with the table by triggers
+            changes     - log every insert, update and delete of rows in table
+                          '<table_name>_changes' by triggers (see changes())
+            raise_errors
+                        - raise sqlite3.Error instead of logging it, e.g. in migrations
             columns     - variable which are names of column and
                           their values which have a type and optional values
                           
@@ -86,91 +419,565 @@ class SQLiteDatabase():
     CREATE TABLE IF NOT EXISTS {table_name}
     (
     {columns_name}
+    );
+
+    -- versions of tables, changed by every write
+    CREATE TABLE IF NOT EXISTS table_versions
+    (
+        table_name text PRIMARY KEY,
+        version integer,
+        modified real
+    );
+    INSERT OR IGNORE INTO table_versions VALUES('{table_name}', 0, {time.time()});"""
+
+        for index_columns, index_type in [(c, 'INDEX') for c in indexes] + [(c, 'UNIQUE INDEX') for c in unique]:
+            index_name  = '_'.join([table_name, *index_columns, 'idx'])
+            script      += f"""
+    CREATE {index_type} IF NOT EXISTS {index_name}
+        ON {table_name}({', '.join(index_columns)});"""
+
+        if search:
+            script += self._search_script(table_name, search)
+
+        if changes:
+            script += self._changes_script(table_name, primary_key)
+
+        # Execute script
+        try:
+            self._execute(script, as_script=True)
+        except sqlite3.Error as error:
+            if raise_errors:
+                raise
+
+            logger.error("Creating table %s failed: %s", table_name, error)
+
+    #--------------------------------
+    def _search_script(self, table_name, columns):
+        """Return script which creates FTS5 index of columns and triggers
+        which update it. Existing rows are indexed only when index is new."""
+
+        search_table    = f"{table_name}_search"
+        names           = ', '.join(columns)
+        new_values      = ', '.join(f"new.{name}" for name in columns)
+        old_values      = ', '.join(f"old.{name}" for name in columns)
+        exists          = self._execute(
+            "SELECT 1 FROM sqlite_master WHERE name = ?", (search_table,), fetch=True
+        )
+
+        script = f"""
+
+    -- full-text search of {table_name}
+    CREATE VIRTUAL TABLE IF NOT EXISTS {search_table}
+        USING fts5({names}, content='{table_name}', content_rowid='rowid');
+
+    CREATE TRIGGER IF NOT EXISTS {search_table}_insert AFTER INSERT ON {table_name} BEGIN
+        INSERT INTO {search_table}(rowid, {names}) VALUES(new.rowid, {new_values});
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS {search_table}_delete AFTER DELETE ON {table_name} BEGIN
+        INSERT INTO {search_table}({search_table}, rowid, {names}) VALUES('delete', old.rowid, {old_values});
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS {search_table}_update AFTER UPDATE ON {table_name} BEGIN
+        INSERT INTO {search_table}({search_table}, rowid, {names}) VALUES('delete', old.rowid, {old_values});
+        INSERT INTO {search_table}(rowid, {names}) VALUES(new.rowid, {new_values});
+    END;"""
+
+        if not exists:
+            script += f"""
+    INSERT INTO {search_table}({search_table}) VALUES('rebuild');"""
+
+        return script
+
+    #--------------------------------
+    @staticmethod
+    def _changes_script(table_name, key):
+        """Return script which creates log of changes of table and triggers which fill it.
+        AUTOINCREMENT keeps sequence numbers increasing, also after deletes."""
+
+        changes_table   = f"{table_name}_changes"
+        now             = "(julianday('now') - 2440587.5) * 86400.0"
+
+        return f"""
+
+    -- log of changes of {table_name}
+    CREATE TABLE IF NOT EXISTS {changes_table}
+    (
+        seq integer PRIMARY KEY AUTOINCREMENT,
+        key text NOT NULL,
+        operation text NOT NULL,
+        changed real NOT NULL
+    );
+
+    CREATE TRIGGER IF NOT EXISTS {changes_table}_insert AFTER INSERT ON {table_name} BEGIN
+        INSERT INTO {changes_table}(key, operation, changed) VALUES(new.{key}, 'insert', {now});
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS {changes_table}_delete AFTER DELETE ON {table_name} BEGIN
+        INSERT INTO {changes_table}(key, operation, changed) VALUES(old.{key}, 'delete', {now});
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS {changes_table}_update AFTER UPDATE ON {table_name} BEGIN
+        INSERT INTO {changes_table}(key, operation, changed)
+            SELECT old.{key}, 'delete', {now} WHERE old.{key} IS NOT new.{key};
+        INSERT INTO {changes_table}(key, operation, changed) VALUES(new.{key}, 'update', {now});
+    END;"""
+
+    #--------------------------------
+    def create_summary(self, table_name, summary_name, group_by, *, order_by=(), indexes=(), incremental=False,
+                       raise_errors=False, **aggregates):
+        """Create a summary table with one row of aggregates for every group of rows of table.
+        Triggers recompute the group of every inserted, updated and deleted row from
+        an index of table, so a page of groups is one indexed lookup of summary.
+        Summary can summarize another summary, e.g. bands from albums.
+        Incremental summary is written by upsert, so update trigger of a summary of it
+        gets old and new values, and if every aggregate is count(*) or sum(column),
+        its triggers add values of every inserted row to its group and subtract values
+        of every deleted one, so a write does not read the group. Summary of another
+        summary can be incremental only if that one is incremental too.
+        Requirement:
+            table_name      - name of a summarized table
+            summary_name    - name of the summary table
+            group_by        - tuple of columns of groups, primary key of summary
+            aggregates      - names of columns of summary and their SQL aggregates,
+                              e.g. tracks='count(*)'
+
+        Optional:
+            order_by        - columns in which aggregates get rows of a group, e.g. for
+                              json_group_array(), '-' before name for descending
+            indexes         - tuples of columns of summary, for each one an index is created
+            incremental     - keep summary by upsert and by adding and subtracting rows,
+                              instead of replacing rows of groups
+            raise_errors    - raise sqlite3.Error instead of logging it, e.g. in migrations
+
+        Function require active connection to database!
+        Existing rows are summarized only when summary is new, triggers are created
+        again by every call, so they follow a changed definition of summary."""
+
+        group       = ', '.join(group_by)
+        order       = ', '.join(f"{name[1:]} DESC" if name.startswith('-') else name for name in order_by)
+        names       = ', '.join([*group_by, *aggregates])
+        values      = ', '.join([*group_by, *aggregates.values()])
+        changed     = ' OR '.join(f"old.{name} IS NOT new.{name}" for name in group_by)
+        exists      = self._execute(
+            "SELECT 1 FROM sqlite_master WHERE name = ?", (summary_name,), fetch=True
+        )
+        # column summed by every aggregate, None for count(*)
+        additive    = {name: re.fullmatch(r"count\(\*\)|sum\((\w+)\)", re.sub(r"\s", '', expression), re.IGNORECASE)
+                       for name, expression in aggregates.items()}
+        # columns read by aggregates, a group is sorted without other columns (e.g. tracklist of albums)
+        used        = ' '.join([*group_by, *order_by, *aggregates.values()])
+        inputs      = ', '.join(row[1] for row in self._execute(f"PRAGMA table_info({table_name})", fetch=True)
+                                if re.search(rf"\b{re.escape(row[1])}\b", used)) or '*'
+
+        def where(row):
+            return ' WHERE ' + ' AND '.join(f"{name} IS {row}.{name}" for name in group_by)
+
+        def summarize(row=None):
+            """Return statements which recompute group of 'row' (new or old), all groups for None.
+            REPLACE does not fire delete triggers, so a summary of this summary is updated once,
+            upsert fires its update trigger with old and new values."""
+
+            source = table_name + (where(row) if row else '')
+
+            if order:
+                source = f"(SELECT {inputs} FROM {source} ORDER BY {group}, {order})"
+
+            if incremental:
+                script = f"""
+        INSERT INTO {summary_name}({names})
+            SELECT {values} FROM {source}
+            GROUP BY {group}
+            ON CONFLICT({group}) DO UPDATE SET {', '.join(f"{name} = excluded.{name}" for name in aggregates)};"""
+            else:
+                script = f"""
+        INSERT OR REPLACE INTO {summary_name}({names})
+            SELECT {values} FROM {source}
+            GROUP BY {group};"""
+
+            if row:
+                script += f"""
+        DELETE FROM {summary_name}{where(row)} AND NOT EXISTS (SELECT 1 FROM {table_name}{where(row)});"""
+
+            return script
+
+        def deltas(row):
+            return [f"coalesce({row}.{match[1]}, 0)" if match[1] else '1' for match in additive.values()]
+
+        def add(row):
+            """Return statement which adds values of 'row' to its group."""
+
+            return f"""
+        INSERT INTO {summary_name}({names})
+            VALUES({', '.join([*(f"{row}.{name}" for name in group_by), *deltas(row)])})
+            ON CONFLICT({group}) DO UPDATE SET {', '.join(f"{name} = {name} + excluded.{name}" for name in aggregates)};"""
+
+        def subtract(row):
+            """Return statements which subtract values of 'row' from its group, an empty group is deleted."""
+
+            return f"""
+        UPDATE {summary_name} SET {', '.join(f"{name} = {name} - {delta}" for name, delta in zip(aggregates, deltas(row)))}{where(row)};
+        DELETE FROM {summary_name}{where(row)} AND NOT EXISTS (SELECT 1 FROM {table_name}{where(row)});"""
+
+        if incremental and aggregates and all(additive.values()):
+            triggers = [('insert', 'INSERT', '', add('new')),
+                        ('delete', 'DELETE', '', subtract('old')),
+                        ('update', 'UPDATE', '', subtract('old') + add('new'))]
+        else:
+            triggers = [('insert', 'INSERT', '', summarize('new')),
+                        ('delete', 'DELETE', '', summarize('old')),
+                        ('update', 'UPDATE', '', summarize('old')),
+                        ('move', 'UPDATE', f"\n        WHEN {changed}", summarize('new'))]
+
+        script = f"""
+    -- summary of {table_name} by {group}
+    CREATE TABLE IF NOT EXISTS {summary_name}
+    (
+        {names},
+        PRIMARY KEY({group})
     );"""
 
+        for index_columns in indexes:
+            script += f"""
+    CREATE INDEX IF NOT EXISTS {'_'.join([summary_name, *index_columns, 'idx'])}
+        ON {summary_name}({', '.join(index_columns)});"""
+
+        for name in ('insert', 'delete', 'update', 'move'):
+            script += f"""
+    DROP TRIGGER IF EXISTS {summary_name}_{name};"""
+
+        for name, event, when, body in triggers:
+            script += f"""
+
+    CREATE TRIGGER {summary_name}_{name} AFTER {event} ON {table_name}{when} BEGIN{body}
+    END;"""
+
+        if not exists:
+            script += summarize()
+
         # Execute script
         try:
-            print(f"Execute:{script}\n")
-            self.cursor.execute(script)
-        except sys.exc_info()[0] as error:
-            print('Error:', error)
+            self._execute(script, as_script=True)
+        except sqlite3.Error as error:
+            if raise_errors:
+                raise
+
+            logger.error("Creating summary %s of %s failed: %s", summary_name, table_name, error)
 
     #--------------------------------
-    def add_to_table(self, table_name, **parameters):
+    @grouped
+    def add_to_table(self, table_name, *, on_conflict=None, **parameters):
         """Add to table row from tuple 'parameters'.
         Requirement:
             parameters  - variables which are values new row a table
-            table_name  - name of a table"""
+            table_name  - name of a table
+
+        Optional:
+            on_conflict - 'nothing' to skip row which breaks an unique constraint
+
+        Return:
+            True if row is added, False if it breaks an unique constraint
+            (or is skipped by on_conflict), None if adding failed for another error."""
 
         # Check parameters
         if not parameters:
             raise TypeError("add_to_table() missing 1 required keyword-only argument: 'parameters'")        
 
         # Create script
-        names_parameters    = ', '.join([str(name) for name in parameters.keys()]) 
-        values_parameters   = tuple([value for value in parameters.values()])
-        values              = '?, '*len(values_parameters)
+        values_parameters   = tuple(parameters.values())
+        script              = build_sql('insert', table_name, tuple(parameters), on_conflict=on_conflict)
 
-        script = f"""
-    INSERT INTO {table_name}({names_parameters})
-        VALUES({values[:-2]})"""
+        # Execute script
+        try:
+            self._execute(script, values_parameters)
+
+            if self.cursor.rowcount > 0:
+                self._touch(table_name)
+
+            self._commit()
+        except sqlite3.IntegrityError as error:
+            logger.error("Adding to %s failed: %s", table_name, error)
+            return False
+        except sqlite3.Error as error:
+            # e.g. locked database, caller must not report it as a conflict
+            self._rollback()
+            logger.error("Adding to %s failed: %s", table_name, error)
+            return None
+
+        return self.cursor.rowcount > 0
+
+    #--------------------------------
+    @grouped
+    def add_many(self, table_name, rows, *, key, batch_size=500, on_conflict=None, raise_errors=False):
+        """Add to table many rows in one transaction.
+        Requirement:
+            table_name  - name of a table
+            rows        - iterable of dicts with the same columns as keys
+            key         - column with value unique for every row (e.g. id),
+                          used to check which rows are added
+
+        Optional:
+            batch_size  - number of rows inserted by one executemany() call
+            on_conflict - 'nothing' to skip rows which break an unique constraint
+            raise_errors
+                        - raise sqlite3.Error instead of logging it
+
+        Return:
+            List with status of every row: True if row is added, False if it is
+            skipped because of a conflict, None if adding failed.
+            On error nothing is added and all rows are None."""
+
+        rows        = iter(rows)
+        batch       = list(itertools.islice(rows, batch_size))
+        statuses    = []
+
+        if not batch:
+            return statuses
+
+        # Create script
+        names   = tuple(batch[0].keys())
+        script  = build_sql('insert', table_name, names, on_conflict=on_conflict)
 
         # Execute script
         try:
-            print(f"Execute with parameters {values_parameters}:\n{script}\n")
-            self.cursor.execute(script, values_parameters)
-            self.connection.commit()
-        except sys.exc_info()[0] as error:
-            print('Error:', error)
+            while batch:
+                keys    = [row[key] for row in batch]
+                # keys which exist before insert are not added, even if they are found after it
+                found   = {row[0] for row in self.select_in(table_name, key, keys, select=key,
+                                                            as_tuple=True, raise_errors=True)}
+
+                self._execute(script, [tuple(row[name] for name in names) for row in batch], many=True)
+
+                added   = {row[0] for row in self.select_in(table_name, key, keys, select=key,
+                                                            as_tuple=True, raise_errors=True)}
+
+                for value in keys:
+                    statuses.append(value in added and value not in found)
+                    # the next rows with the same key are conflicts of the first one
+                    found.add(value)
+
+                batch = list(itertools.islice(rows, batch_size))
+
+            if any(statuses):
+                self._touch(table_name)
+
+            self._commit()
+        except sqlite3.Error as error:
+            self._rollback()
+
+            if raise_errors:
+                raise
+
+            logger.error("Adding many rows to %s failed: %s", table_name, error)
+            # every row gets a status, also rows which are not read yet
+            return [None] * (len(statuses) + len(batch) + sum(1 for _ in rows))
+        except BaseException:
+            # rows may be a generator reading a file, its error must not leave half of rows
+            self._rollback()
+            raise
+
+        return statuses
 
     #--------------------------------    
-    def select_from_table(self, table_name, select='*', **parameters):
+    def select_from_table(self, table_name, select='*', *, order_by=None, limit=None, offset=None,
+                          as_tuple=False, **parameters):
         """Return rows which parameters.
         Requirement:
             table_name  - name of a table
 
         Optional:
             select      - columns which will be return
-            parameters  - conditions of search.
+            order_by    - column or list of columns of ordering, '-' before name for descending
+            limit       - maximal number of rows
+            offset      - number of skipped rows
+            as_tuple    - return rows as tuples of values instead of dicts
+            parameters  - conditions of search, name of column with optional
+                          suffix of operator: __ne, __lt, __le, __gt, __ge, __in
                           
         Return:
             List of result of search."""
 
         # Create script
-        result      = []
-        values      = tuple([value for value in parameters.values()])
-        conditions  = '=? AND '.join([name for name in parameters.keys()]) + '=?'
-        
+        result          = []
+        script, values  = self._select_script(table_name, select, parameters,
+                                              order_by=order_by, limit=limit, offset=offset)
+
+        # Execute script
+        try:
+            self.cursor = self.connection.cursor()
+            result      = self._materialize(self.cursor, self._execute(script, values, fetch=True), as_tuple)
+        except sqlite3.Error as error:
+            logger.error("Selecting from %s failed: %s", table_name, error)
+
+        return result
+
+    #--------------------------------
+    def select_in(self, table_name, column, values, select='*', *, chunk_size=900,
+                  as_tuple=False, raise_errors=False):
+        """Return rows which value of column is one of values, found by
+        'column IN (...)' queries with at most chunk_size values each
+        (SQLite limits number of parameters of a query).
+        Requirement:
+            table_name  - name of a table
+            column      - name of compared column
+            values      - sequence of searched values
+
+        Optional:
+            select      - columns which will be return
+            chunk_size  - maximal number of values in one query
+            as_tuple    - return rows as tuples of values instead of dicts
+            raise_errors
+                        - raise sqlite3.Error instead of logging it
+
+        Return:
+            List of result of search."""
+
+        values = list(values)
+        result = []
+
         if type(select) in [list, tuple, set]:
-            select = list(select)
-            select = ', '.join(select)
+            select = ', '.join(list(select))
+
+        try:
+            cursor = self.connection.cursor()
 
-        
+            for start in range(0, len(values), chunk_size):
+                chunk   = values[start:start + chunk_size]
+                script  = build_sql('select', table_name, conditions=((column, 'in', len(chunk)),),
+                                    select=select.lower())
+                result  += self._materialize(cursor, self._execute(script, chunk, cursor=cursor, fetch=True), as_tuple)
+        except sqlite3.Error as error:
+            if raise_errors:
+                raise
 
-        script = f"""
-    SELECT {select.lower()} FROM {table_name}"""
+            logger.error("Selecting from %s failed: %s", table_name, error)
 
-        if parameters:
-            script  += f" WHERE {conditions}"
-            msg     = f"Execute with parameters {values}:\n{script}\n"
-        else:
-            msg = f"Execute:\n{script}\n"
+        return result
+
+    #--------------------------------
+    def _select_script(self, table_name, select, parameters, *, order_by=None, after=None,
+                       limit=None, offset=None):
+        """Return script and values of select, arguments as in iter_select()."""
+
+        conditions, values = split_conditions(parameters)
+
+        if type(select) in [list, tuple, set]:
+            select = ', '.join(list(select))
+
+        if type(order_by) in [list, tuple]:
+            order_by = ', '.join(f"{name[1:]} DESC" if name.startswith('-') else name for name in order_by)
+        elif order_by and order_by.startswith('-'):
+            order_by = f"{order_by[1:]} DESC"
+
+        if after is not None:
+            if not order_by or ',' in order_by or ' ' in order_by:
+                raise TypeError("Argument 'after' requires 'order_by' with one column in ascending order")
+
+            values.append(after)
+
+        if limit is not None:
+            values.append(limit)
+
+        if offset:
+            values.append(offset)
+
+        script = build_sql('select', table_name, conditions=conditions, select=select.lower(),
+                           order_by=order_by, after=after is not None, limit=limit is not None,
+                           offset=bool(offset))
+
+        return script, tuple(values)
+
+    #--------------------------------
+    def iter_select(self, table_name, select='*', *, order_by=None, after=None, limit=None,
+                    offset=None, chunk_size=500, as_tuple=False, **parameters):
+        """Yield rows which parameters one by one, without building the list of all rows.
+        Requirement:
+            table_name  - name of a table
+
+        Optional:
+            select      - columns which will be return
+            order_by    - column or list of columns of ordering, '-' before name for descending
+            after       - value of 'order_by' column, only next rows are returned,
+                          'order_by' must be one column in ascending order
+            limit       - maximal number of rows
+            offset      - number of skipped rows
+            chunk_size  - number of rows fetched from cursor at once
+            as_tuple    - yield rows as tuples of values instead of dicts
+            parameters  - conditions of search, see select_from_table()
+
+        Generator takes own connection, so it can be consumed after disconnect(),
+        for example by a streamed response."""
+
+        # Create script
+        script, values = self._select_script(table_name, select, parameters, order_by=order_by,
+                                             after=after, limit=limit, offset=offset)
+
+        # Execute script
+        with self:
+            duration    = 0.0
+            count       = 0
+
+            try:
+                start       = time.perf_counter()
+                cursor      = self.connection.execute(script, values)
+                rows        = cursor.fetchmany(chunk_size)
+                duration    += time.perf_counter() - start
+
+                while rows:
+                    count += len(rows)
+                    yield from self._materialize(cursor, rows, as_tuple)
+
+                    start       = time.perf_counter()
+                    rows        = cursor.fetchmany(chunk_size)
+                    duration    += time.perf_counter() - start
+            except sqlite3.Error as error:
+                logger.error("Selecting from %s failed: %s", table_name, error)
+            finally:
+                # Time of consumer between chunks is not counted
+                self._report(script, values, duration, count)
+
+    #--------------------------------
+    def search(self, table_name, query, select='*', *, limit=20, offset=0):
+        """Return rows found by full-text search, the best matches first.
+        Requirement:
+            table_name  - name of a table created with 'search' columns
+            query       - words to find, every one can be a beginning of word
+
+        Optional:
+            select      - columns which will be return
+            limit       - maximal number of rows
+            offset      - number of skipped rows
+
+        Return:
+            List of result of search."""
+
+        words = [word.replace('"', '""') for word in query.split()]
+
+        if not words:
+            return []
+
+        # Create script
+        match = ' '.join(f'"{word}"*' for word in words)
+
+        if type(select) in [list, tuple, set]:
+            select = ', '.join(f"{table_name}.{name}" for name in select)
+        elif select == '*':
+            select = f"{table_name}.*"
+
+        script = f"SELECT {select} FROM {table_name}_search JOIN {table_name} " \
+                 f"ON {table_name}.rowid = {table_name}_search.rowid " \
+                 f"WHERE {table_name}_search MATCH ? ORDER BY rank LIMIT ? OFFSET ?"
 
         # Execute script
         try:
-            print(msg)
-            
-            self.cursor = self.connection.cursor()
-            self.cursor.execute(script, values)
-            result = self.cursor.fetchall()
-            result = json.dumps([dict(row) for row in result])
-            result = json.loads(result)
-        except sys.exc_info()[0] as error:
-            print('Error:', error)
-        finally:
-            return result
+            cursor = self.connection.cursor()
+            return self._materialize(cursor, self._execute(script, (match, limit, offset), cursor=cursor, fetch=True))
+        except sqlite3.Error as error:
+            logger.error("Searching in %s failed: %s", table_name, error)
+            return []
 
     #--------------------------------
+    @grouped
     def update_row(self, table_name, primary_key, **parameters):
         """Update a row in table.
         Requirement:
@@ -178,32 +985,41 @@ class SQLiteDatabase():
             primary_key - dict with 'name' and 'value' of primary key
             
         Optiona:
-            parameters  - variables of new values in rows, must be min one"""
+            parameters  - variables of new values in rows, must be min one
+
+        Return:
+            True if row is modified, False if it is not found or breaks an unique
+            constraint, None if updating failed for another error."""
 
         # Check parameters
         if not parameters:
             raise TypeError("update_row() missing 1 required keyword-only argument: 'parameters'")
 
         # Create script
-        columns = ' = ?, '.join([name for name in parameters.keys()]) + ' = ?'
-        values  = [value for value in parameters.values()] + [primary_key['value']]
-        values  = tuple(values)
-        key     = primary_key['name']
-
-        script = f"""
-    UPDATE {table_name}
-        SET {columns}
-        WHERE {key} = ?"""
+        values  = (*parameters.values(), primary_key['value'])
+        script  = build_sql('update', table_name, tuple(parameters), key=primary_key['name'])
 
         # Execute script
         try:
-            print(f"Execute with parameters {values}:{script}\n")
-            self.cursor.execute(script, values)
-            self.connection.commit()
-        except sys.exc_info()[0] as error:
-            print('Error:', error)
+            self._execute(script, values)
+
+            if self.cursor.rowcount > 0:
+                self._touch(table_name)
+
+            self._commit()
+        except sqlite3.IntegrityError as error:
+            logger.error("Updating %s failed: %s", table_name, error)
+            return False
+        except sqlite3.Error as error:
+            # e.g. locked database, caller must not report it as a conflict
+            self._rollback()
+            logger.error("Updating %s failed: %s", table_name, error)
+            return None
+
+        return self.cursor.rowcount > 0
 
     #--------------------------------
+    @grouped
     def delete(self, table_name, **parameters):
         """Remove row in table.
         Requirement:
@@ -213,29 +1029,483 @@ class SQLiteDatabase():
             parameters  - conditions of removing"""
 
         # Create script
-        script  = f"""
-    DELETE FROM {table_name}"""
-
-        if parameters:
-            conditions  = '=? AND '.join([name for name in parameters.keys()]) + '=?'
-            values      = tuple([value for value in parameters.values()])
-            script      += f" WHERE {conditions}"
+        conditions, values  = split_conditions(parameters)
+        values              = tuple(values)
+        script              = build_sql('delete', table_name, conditions=conditions)
 
         # Execute script
         try:
-            if parameters:
-                print(f"Execute with parameters {values}:\n{script}\n")
-                self.cursor.execute(script, values)
-            else:
-                print(f"Execute:\n{script}\n")
-                self.cursor.execute(script)
+            self._execute(script, values)
 
-            self.connection.commit()
-        except sys.exc_info()[0] as error:
-            print('Error:', error)
+            if self.cursor.rowcount > 0:
+                self._touch(table_name)
+
+            self._commit()
+        except sqlite3.Error as error:
+            logger.error("Deleting from %s failed: %s", table_name, error)
+
+    #--------------------------------
+    def _touch(self, table_name):
+        """Increase version of table, in transaction of the write which changed it."""
+
+        self._execute(
+            "INSERT INTO table_versions VALUES(?, 1, ?) ON CONFLICT(table_name) "
+            "DO UPDATE SET version = version + 1, modified = excluded.modified",
+            (table_name, time.time()),
+            cursor=self.connection.cursor()
+        )
+
+    #--------------------------------
+    def table_version(self, table_name):
+        """Return version of table and time of its last change (seconds since epoch).
+        Version is increased by every add_to_table(), add_many(), update_row()
+        and delete() which changes a row, so it can be used as ETag of table content.
+
+        Function require active connection to database!"""
+
+        try:
+            rows = self._execute(
+                "SELECT version, modified FROM table_versions WHERE table_name = ?",
+                (table_name,),
+                cursor=self.connection.cursor(),
+                fetch=True
+            )
+        except sqlite3.Error as error:
+            logger.error("Reading version of %s failed: %s", table_name, error)
+            rows = None
+
+        return tuple(rows[0]) if rows else (0, 0.0)
+
+    #--------------------------------
+    def changes(self, table_name, key, since=0, limit=100, select='*'):
+        """Return changes of table logged after sequence number 'since', the oldest first.
+        Every change has seq, key, operation ('insert', 'update' or 'delete'),
+        changed (seconds since epoch) and columns of the current row,
+        which are None if row is deleted.
+        Requirement:
+            table_name  - table created with changes=True
+            key         - primary key of table
+
+        Optional:
+            since       - sequence number of the last change known by the caller
+            limit       - maximal number of changes
+            select      - columns of rows
+
+        Function require active connection to database!"""
+
+        columns = ', '.join(f"t.{column}" for column in ([select] if isinstance(select, str) else select))
+        script  = f"""SELECT c.seq, c.key, c.operation, c.changed, {columns}
+            FROM {table_name}_changes AS c LEFT JOIN {table_name} AS t ON t.{key} = c.key
+            WHERE c.seq > ? ORDER BY c.seq LIMIT ?"""
+
+        try:
+            cursor = self._execute(script, (since, limit), cursor=self.connection.cursor())
+            return self._materialize(cursor, cursor.fetchall())
+        except sqlite3.Error as error:
+            logger.error("Reading changes of %s failed: %s", table_name, error)
+            return []
+
+    #--------------------------------
+    def last_change(self, table_name):
+        """Return sequence number of the last change of table, 0 if there is no change.
+
+        Function require active connection to database!"""
+
+        try:
+            rows = self._execute(f"SELECT max(seq) FROM {table_name}_changes",
+                                 cursor=self.connection.cursor(), fetch=True)
+        except sqlite3.Error as error:
+            logger.error("Reading changes of %s failed: %s", table_name, error)
+            rows = None
+
+        return (rows[0][0] or 0) if rows else 0
+
+    #--------------------------------
+    def migrate(self, migrations):
+        """Apply migrations which are not applied to database file yet.
+        Number of applied migrations is kept in PRAGMA user_version, so every
+        migration runs once for a file; after the first call it only compares numbers.
+        Migration should be idempotent (CREATE ... IF NOT EXISTS), because it runs
+        again if the process stops before user_version is saved. Migration has to raise
+        its errors (e.g. raise_errors of create_table()), a failed migration is not
+        counted as applied and it runs again by the next call.
+        Requirement:
+            migrations  - list of functions called with database, new ones are appended at the end
+
+        Return:
+            number of applied migrations"""
+
+        if self.schema_version == len(migrations):
+            return 0
+
+        with self._migration_lock, self:
+            version = self._execute("PRAGMA user_version", fetch=True)[0][0]
+
+            if version > len(migrations):
+                raise sqlite3.DatabaseError(f"Version of database {version} is newer than {len(migrations)} migrations")
+
+            for number, migration in enumerate(migrations[version:], version + 1):
+                logger.info("Applying migration %d (%s) to %s", number, migration.__name__, self.file)
+
+                try:
+                    migration(self)
+                except Exception as error:
+                    logger.error("Migration %d (%s) of %s failed: %s", number, migration.__name__, self.file, error)
+                    self._rollback()
+                    raise
+
+                self._execute(f"PRAGMA user_version = {number}")
+                self._commit()
+
+            self.schema_version = len(migrations)
+
+        return len(migrations) - version
+
+#================================================================
+class ReplicaConnection(sqlite3.Connection):
+    """Connection of SQLiteReplica, 'generation' is number of the snapshot,
+    None for a read-only connection to primary."""
+
+    generation = 0
+
+#================================================================
+class SQLiteReplica(SQLiteDatabase):
+    """Read-only copy of primary database in a local file, made by sqlite3 backup API.
+    Copy is refreshed by a read when it is older than 'max_staleness' seconds,
+    and only if primary has changed, so there is at most one copy per 'max_staleness'.
+    After a commit to primary in this process, reads go to primary until the next
+    refresh, so a process reads its own writes without an extra copy.
+    Refresh writes a new file and renames it over the old one, so reads are not
+    blocked by it; connections are reopened when they are taken for the next read.
+    Writes have to be done by the primary.
+    Requirement:
+        primary         - SQLiteDatabase with file
+
+    Optional:
+        file            - path of local copy, in temporary directory by default
+        max_staleness   - maximal age of read data in seconds
+        options         - options of SQLiteDatabase (pool_size, mmap_size, ...)"""
+
+    def __init__(self, primary, file=None, max_staleness=1.0, **options):
+        if not file:
+            name = os.path.splitext(os.path.basename(primary.file))[0]
+            file = os.path.join(tempfile.gettempdir(), f"{name}-replica-{os.getpid()}-{id(self)}.db")
+
+        super().__init__(file=file, **{'journal_mode': None, 'synchronous': None, **options})
+
+        self.primary        = primary
+        self.max_staleness  = max_staleness
+        self.generation     = 0
+        self.refreshes      = 0
+        self.copies         = 0
+        self.primary_reads  = 0
+        self._refreshed     = None
+        self._written       = None
+        self._data_version  = None
+        self._source        = None
+        self._refresh_lock  = threading.Lock()
+
+        primary.replicas.add(self)
+
+    #--------------------------------
+    def __repr__(self):
+        return f"SQLite replica of {self.primary.file} in {self.file}"
+
+    #--------------------------------
+    def _open(self, primary=False):
+        """Open connection to the current snapshot; it is immutable, so SQLite skips locking.
+        With primary=True open read-only connection to primary instead."""
+
+        # path is quoted, so ?, # and % in it are not read as parts of URI
+        if primary:
+            uri = f"{pathlib.Path(os.path.abspath(self.primary.file)).as_uri()}?mode=ro"
+        else:
+            uri = f"{pathlib.Path(os.path.abspath(self.file)).as_uri()}?mode=ro&immutable=1"
+
+        connection = sqlite3.connect(uri, uri=True, check_same_thread=False,
+                                     cached_statements=self.cached_statements, factory=ReplicaConnection)
+        connection.generation = None if primary else self.generation
+
+        for name, value in self.pragmas.items():
+            if value is not None:
+                connection.execute(f"PRAGMA {name} = {value}")
+
+        return connection
+
+    #--------------------------------
+    def connect(self):
+        """Activate connection with the current snapshot, refresh it first if it is too old.
+        Connection to primary is used instead while the snapshot is older than a local write."""
+
+        if self.connection:
+            return super().connect()
+
+        if self.is_stale():
+            self.refresh()
+
+        generation = None if self.is_behind() else self.generation
+        connection = super().connect()
+
+        if connection and connection.generation != generation:
+            connection.close()
+            self.connection = self._open(primary=generation is None)
+            self.cursor     = self.connection.cursor()
+
+        if generation is None:
+            self.primary_reads += 1
+
+        return self.connection
+
+    #--------------------------------
+    def is_stale(self):
+        return self._refreshed is None or time.monotonic() - self._refreshed > self.max_staleness
+
+    #--------------------------------
+    def is_behind(self):
+        """Return True if snapshot was copied before the last commit to primary in this process."""
+
+        written = self._written
+
+        return written is not None and (self._refreshed is None or self._refreshed < written)
+
+    #--------------------------------
+    def written(self):
+        """Record commit to primary, reads go to primary until the next refresh."""
+
+        self._written = time.monotonic()
+
+    #--------------------------------
+    def expire(self):
+        """Refresh copy before the next read."""
+
+        self._refreshed = None
+
+    #--------------------------------
+    def refresh(self):
+        """Copy primary to a new snapshot file if primary changed since the last copy."""
+
+        with self._refresh_lock:
+            if not self.is_stale():
+                return
+
+            started = time.monotonic()
+
+            if not self._source:
+                self._source = sqlite3.connect(self.primary.file, check_same_thread=False)
+
+            data_version = self._source.execute("PRAGMA data_version").fetchone()[0]
+
+            if data_version != self._data_version or not os.path.exists(self.file):
+                copy_file   = f"{self.file}.{self.generation + 1}.tmp"
+                copy        = sqlite3.connect(copy_file)
+
+                try:
+                    self._source.backup(copy)
+                    copy.execute("PRAGMA journal_mode = delete")
+                finally:
+                    copy.close()
+
+                os.replace(copy_file, self.file)
+                self.generation     += 1
+                self.copies         += 1
+                self._data_version  = data_version
+                logger.debug("Replica %s refreshed in %.3f ms", self.file, (time.monotonic() - started) * 1000)
+
+            self.refreshes  += 1
+            self._refreshed = started
+
+    #--------------------------------
+    def close(self):
+        """Close connections and remove local copy."""
+
+        super().close()
+
+        if getattr(self, '_source', None):
+            self._source.close()
+            self._source = None
+
+        if os.path.exists(self.file):
+            os.remove(self.file)
+
+    #--------------------------------
+    @property
+    def stats(self):
+        """Number of refreshes, copies of primary, reads from primary and age of snapshot in seconds."""
+
+        return {
+            'generation':       self.generation,
+            'refreshes':        self.refreshes,
+            'copies':           self.copies,
+            'primary_reads':    self.primary_reads,
+            'age':              time.monotonic() - self._refreshed if self._refreshed is not None else None
+        }
+
+#================================================================
+class GroupCommitWriter():
+    """Thread which executes writes of SQLiteDatabase sent by many threads
+    and commits them in groups, so many writes share one commit (and fsync).
+    Thread which sent a write waits until the group with it is committed.
+    Every write runs in own savepoint, so its error does not cancel the others.
+    Requirement:
+        database    - SQLiteDatabase
+
+    Optional:
+        max_size    - maximal number of writes in one group
+        max_delay   - time in seconds waited for next writes before commit,
+                      0 groups only writes sent during previous commit"""
+
+    def __init__(self, database, max_size=100, max_delay=0):
+        self.database       = database
+        self.max_size       = max_size
+        self.max_delay      = max_delay
+        self.groups         = 0
+        self.writes         = 0
+        self.largest_group  = 0
+        self.commit_time    = 0.0
+        self.slowest_commit = 0.0
+        self._queue         = queue.Queue()
+        self._thread        = None
+        self._lock          = threading.Lock()
+
+    #--------------------------------
+    def __repr__(self):
+        return f"Group commit writer of {self.database}"
+
+    #--------------------------------
+    def is_current(self):
+        """Return True if it is called by writer thread."""
+
+        return threading.current_thread() is self._thread
+
+    #--------------------------------
+    def submit(self, function, *args, **kwargs):
+        """Execute function in writer thread and return its result after commit."""
+
+        with self._lock:
+            # thread is started by the first write and again if it stopped on an unexpected error
+            if not self._thread or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='sqlite-writer', daemon=True)
+                self._thread.start()
+
+        future = Future()
+        self._queue.put((future, function, args, kwargs))
+
+        return future.result()
+
+    #--------------------------------
+    def stop(self):
+        """Commit waiting writes and stop writer thread."""
+
+        with self._lock:
+            if self._thread:
+                self._queue.put(None)
+                self._thread.join()
+                self._thread = None
+
+    #--------------------------------
+    def _next_group(self):
+        """Return writes sent during max_delay after the first one,
+        None at the end of the list means that writer has to stop."""
+
+        group       = [self._queue.get()]
+        deadline    = time.monotonic() + self.max_delay
+
+        while group[-1] is not None and len(group) < self.max_size:
+            try:
+                group.append(self._queue.get(timeout=max(deadline - time.monotonic(), 0)))
+            except queue.Empty:
+                break
+
+        return group
+
+    #--------------------------------
+    def _run(self):
+        database                = self.database
+        database._local.grouped = True
+
+        with database:
+            while True:
+                group   = self._next_group()
+                writes  = [write for write in group if write is not None]
+
+                if writes:
+                    self._write(writes)
+
+                if group[-1] is None:
+                    return
+
+    #--------------------------------
+    def _write(self, writes):
+        """Execute writes in one transaction and resolve their futures.
+        Every future gets a result or an error, also if the transaction itself fails
+        (e.g. SQLite rolled it back on a full disk and savepoint is gone)
+        or the thread is stopped."""
+
+        connection  = self.database.connection
+        stopped     = RuntimeError("Writer thread stopped")
+        results     = [(future, None, stopped) for future, _, _, _ in writes]
+
+        try:
+            executed = []
+            connection.execute("BEGIN")
+
+            for future, function, args, kwargs in writes:
+                connection.execute("SAVEPOINT write")
+
+                try:
+                    executed.append((future, function(*args, **kwargs), None))
+                except Exception as error:
+                    connection.execute("ROLLBACK TO write")
+                    executed.append((future, None, error))
+
+                connection.execute("RELEASE write")
+
+            start = time.perf_counter()
+            connection.commit()
+            self.database._notify_replicas()
+            self._count(len(writes), time.perf_counter() - start)
+            results = executed
+        except Exception as error:
+            logger.error("Group commit failed: %s", error)
+            results = [(future, None, error) for future, _, _, _ in writes]
+
+            try:
+                connection.rollback()
+            except sqlite3.Error as rollback_error:
+                logger.error("Rollback of group failed: %s", rollback_error)
+        finally:
+            for future, result, error in results:
+                if error:
+                    future.set_exception(error)
+                else:
+                    future.set_result(result)
+
+    #--------------------------------
+    def _count(self, size, commit_time):
+        self.groups         += 1
+        self.writes         += size
+        self.largest_group  = max(self.largest_group, size)
+        self.commit_time    += commit_time
+        self.slowest_commit = max(self.slowest_commit, commit_time)
+
+    #--------------------------------
+    @property
+    def stats(self):
+        """Counters of groups and commit time in seconds."""
+
+        return {
+            'groups':               self.groups,
+            'writes':               self.writes,
+            'average_group_size':   self.writes / self.groups if self.groups else 0,
+            'largest_group':        self.largest_group,
+            'average_commit_time':  self.commit_time / self.groups if self.groups else 0,
+            'slowest_commit':       self.slowest_commit
+        }
 
 #================================================================
 if __name__ == '__main__':
+    logging.basicConfig(level=logging.DEBUG)
+
     database = SQLiteDatabase(file="")
     print(database)
 
@@ -0,0 +1,116 @@
+import json, zlib
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+#================================================================
+def stdlib_dumps(data):
+    """Compact JSON by json module."""
+
+    return json.dumps(data, separators=(',', ':'))
+
+#--------------------------------
+def orjson_dumps(data):
+    """JSON by orjson, several times faster than json module."""
+
+    return orjson.dumps(data).decode()
+
+#--------------------------------
+json_encoders = {'json': stdlib_dumps}
+
+if orjson:
+    json_encoders['orjson'] = orjson_dumps
+
+#--------------------------------
+def get_json_encoder(name=None):
+    """Return function which encodes data to JSON string.
+    Optional:
+        name    - name from json_encoders, None for the fastest installed one"""
+
+    if name is None:
+        name = 'orjson' if orjson else 'json'
+
+    if name not in json_encoders:
+        raise ValueError(f"JSON encoder {name} is not available, choose from: {', '.join(json_encoders)}")
+
+    return json_encoders[name]
+
+#================================================================
+compressible_mimetypes = ('application/json', 'application/x-ndjson', 'text/')
+# events have to reach client at once, compression would buffer them
+uncompressed_mimetypes = ('text/event-stream',)
+
+#--------------------------------
+def gzip_stream(chunks, level=6, flush_size=64 * 1024):
+    """Compress iterable of chunks to gzip on the fly.
+    Compressed data is flushed after every 'flush_size' bytes of input,
+    so a client of a long stream gets rows without waiting for its end."""
+
+    compressor  = zlib.compressobj(level, zlib.DEFLATED, 31)
+    pending     = 0
+
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode()
+
+            data    = compressor.compress(chunk)
+            pending += len(chunk)
+
+            if pending >= flush_size:
+                data    += compressor.flush(zlib.Z_SYNC_FLUSH)
+                pending = 0
+
+            if data:
+                yield data
+
+        yield compressor.flush()
+    finally:
+        # WSGI server closes only the outer iterable
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+#--------------------------------
+def compress_response(response, accept_encodings, min_size=1024, level=6):
+    """Compress body of Flask response with gzip if client accepts it.
+    Bodies smaller than 'min_size' bytes are not compressed,
+    streamed bodies are always compressed, because their size is unknown.
+    Requirement:
+        response            - Flask response
+        accept_encodings    - Accept-Encoding of request (request.accept_encodings)
+
+    Optional:
+        min_size            - minimal size of body in bytes
+        level               - level of compression from 1 (fastest) to 9 (smallest)
+
+    Return:
+        response"""
+
+    if response.status_code != 200 or response.direct_passthrough \
+            or 'Content-Encoding' in response.headers \
+            or not response.mimetype.startswith(compressible_mimetypes) \
+            or response.mimetype in uncompressed_mimetypes:
+        return response
+
+    response.vary.add('Accept-Encoding')
+
+    if not accept_encodings['gzip']:
+        return response
+
+    if response.is_streamed:
+        response.response = gzip_stream(response.response, level)
+        response.headers.pop('Content-Length', None)
+    else:
+        body = response.get_data()
+
+        if len(body) < min_size:
+            return response
+
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+        response.set_data(compressor.compress(body) + compressor.flush())
+
+    response.headers['Content-Encoding'] = 'gzip'
+
+    return response
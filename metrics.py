@@ -0,0 +1,234 @@
+import os, io, re, time, threading, logging, cProfile, pstats
+from bisect import bisect_left
+
+logger = logging.getLogger(__name__)
+
+#================================================================
+time_buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+rows_buckets = (0, 1, 10, 100, 1000, 10_000, 100_000)
+
+#--------------------------------
+def format_labels(labels):
+    """Return labels in Prometheus text format: {name="value",...}."""
+
+    if not labels:
+        return ''
+
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for value in labels.values())
+
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+#================================================================
+class Histogram():
+    """Counts of observed values in buckets with their sum, not thread-safe.
+    Requirement:
+        buckets     - sorted upper bounds of buckets"""
+
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets    = buckets
+        self.counts     = [0] * (len(buckets) + 1)
+        self.sum        = 0
+        self.count      = 0
+
+    #--------------------------------
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum    += value
+        self.count  += 1
+
+    #--------------------------------
+    def samples(self, name, labels):
+        """Return lines of histogram in Prometheus text format."""
+
+        lines   = []
+        total   = 0
+
+        for bound, count in zip((*self.buckets, '+Inf'), self.counts):
+            total += count
+            lines.append(f"{name}_bucket{format_labels({**labels, 'le': bound})} {total}")
+
+        lines.append(f"{name}_sum{format_labels(labels)} {self.sum}")
+        lines.append(f"{name}_count{format_labels(labels)} {self.count}")
+
+        return lines
+
+#================================================================
+class Metrics():
+    """Thread-safe metrics of requests rendered in Prometheus text format.
+    Time of database in a request is collected by query_hook(),
+    which has to be added to query_hooks of SQLiteDatabase.
+    Optional:
+        prefix          - prefix of names of metrics
+        time_buckets    - upper bounds of buckets of time in seconds
+        rows_buckets    - upper bounds of buckets of number of rows"""
+
+    def __init__(self, prefix='songs', time_buckets=time_buckets, rows_buckets=rows_buckets):
+        self.prefix     = prefix
+        self.families   = {}
+        self._local     = threading.local()
+        self._lock      = threading.Lock()
+
+        self.add('http_requests_total', 'counter', "Number of requests")
+        self.add('http_request_duration_seconds', 'histogram', "Time of requests", time_buckets)
+        self.add('http_request_db_seconds', 'histogram', "Time of database queries in requests", time_buckets)
+        self.add('http_request_app_seconds', 'histogram', "Time of requests without database", time_buckets)
+        self.add('http_request_db_queries_total', 'counter', "Number of database queries in requests")
+        self.add('http_request_db_rows', 'histogram', "Rows read or written by queries of requests", rows_buckets)
+
+    #--------------------------------
+    def __repr__(self):
+        return f"Metrics {self.prefix} with {len(self.families)} families"
+
+    #--------------------------------
+    def add(self, name, kind, description, buckets=None):
+        """Add family of metrics of kind 'counter', 'gauge' or 'histogram'."""
+
+        self.families[name] = {'kind': kind, 'description': description, 'buckets': buckets, 'values': {}}
+
+    #--------------------------------
+    def observe(self, name, value, **labels):
+        """Add value to histogram or counter, set value of gauge."""
+
+        family  = self.families[name]
+        key     = tuple(labels.items())
+
+        with self._lock:
+            if family['kind'] == 'histogram':
+                if key not in family['values']:
+                    family['values'][key] = Histogram(family['buckets'])
+
+                family['values'][key].observe(value)
+            elif family['kind'] == 'counter':
+                family['values'][key] = family['values'].get(key, 0) + value
+            else:
+                family['values'][key] = value
+
+    #--------------------------------
+    def set(self, name, value, **labels):
+        """Set value of counter or gauge counted outside of metrics (e.g. by LRUCache)."""
+
+        with self._lock:
+            self.families[name]['values'][tuple(labels.items())] = value
+
+    #--------------------------------
+    def start_request(self):
+        """Start measurement of a request in the current thread."""
+
+        local           = self._local
+        local.start     = time.perf_counter()
+        local.db_time   = 0
+        local.queries   = 0
+        local.rows      = 0
+        local.active    = True
+
+    #--------------------------------
+    def query_hook(self, script, values, duration, rows):
+        """Count query executed in a request of the current thread, for query_hooks of SQLiteDatabase."""
+
+        local = self._local
+
+        if getattr(local, 'active', False):
+            local.db_time   += duration
+            local.queries   += 1
+            local.rows      += max(rows, 0)
+
+    #--------------------------------
+    def finish_request(self, method, endpoint, status):
+        """Record request started by start_request() in the current thread."""
+
+        local = self._local
+
+        if not getattr(local, 'active', False):
+            return
+
+        local.active    = False
+        duration        = time.perf_counter() - local.start
+
+        self.observe('http_requests_total', 1, method=method, endpoint=endpoint, status=status)
+        self.observe('http_request_duration_seconds', duration, method=method, endpoint=endpoint)
+        self.observe('http_request_db_seconds', local.db_time, method=method, endpoint=endpoint)
+        self.observe('http_request_app_seconds', duration - local.db_time, method=method, endpoint=endpoint)
+        self.observe('http_request_db_queries_total', local.queries, method=method, endpoint=endpoint)
+        self.observe('http_request_db_rows', local.rows, method=method, endpoint=endpoint)
+
+    #--------------------------------
+    def render(self):
+        """Return all metrics in Prometheus text format."""
+
+        lines = []
+
+        with self._lock:
+            for name, family in self.families.items():
+                name = f"{self.prefix}_{name}"
+
+                lines.append(f"# HELP {name} {family['description']}")
+                lines.append(f"# TYPE {name} {family['kind']}")
+
+                for key, value in family['values'].items():
+                    if family['kind'] == 'histogram':
+                        lines.extend(value.samples(name, dict(key)))
+                    else:
+                        lines.append(f"{name}{format_labels(dict(key))} {value}")
+
+        return '\n'.join(lines) + '\n'
+
+#================================================================
+class Profiler():
+    """Profiler of every N-th request by cProfile.
+    Profile is saved to a file for pstats/snakeviz if directory is set,
+    otherwise the slowest functions are logged.
+    Optional:
+        every       - profile every N-th request, 0 turns profiler off
+        directory   - directory for files of profiles
+        limit       - number of logged functions"""
+
+    def __init__(self, every=0, directory=None, limit=20):
+        self.every      = every
+        self.directory  = directory
+        self.limit      = limit
+        self.requests   = 0
+        self._local     = threading.local()
+        self._lock      = threading.Lock()
+
+    #--------------------------------
+    def __repr__(self):
+        return f"Profiler of every {self.every} request" if self.every else "Disabled profiler"
+
+    #--------------------------------
+    def start(self):
+        """Start profiling of the current thread if it is N-th request."""
+
+        if not self.every:
+            return
+
+        with self._lock:
+            self.requests   += 1
+            sampled         = self.requests % self.every == 0
+
+        if sampled:
+            self._local.profile = cProfile.Profile()
+            self._local.profile.enable()
+
+    #--------------------------------
+    def stop(self, name):
+        """Stop profiling of the current thread and save or log profile as 'name'."""
+
+        profile = getattr(self._local, 'profile', None)
+
+        if not profile:
+            return
+
+        profile.disable()
+        self._local.profile = None
+
+        if self.directory:
+            name        = re.sub(r'\W+', '_', name).strip('_')
+            file_name   = f"{time.strftime('%Y%m%d-%H%M%S')}-{self.requests}-{name}.prof"
+            profile.dump_stats(os.path.join(self.directory, file_name))
+        else:
+            output = io.StringIO()
+            pstats.Stats(profile, stream=output).sort_stats('cumulative').print_stats(self.limit)
+            logger.info("Profile of %s:\n%s", name, output.getvalue())
@@ -1,16 +1,89 @@
 from marshmallow import Schema, fields, post_load
 from uuid import uuid4
 
+#================================================================
+# Definition of table of songs for SQLiteDatabase.create_table() by the first migration,
+# it must not change, next migrations add their parts to it
+songs_table = {
+    'table_name':   'songs',
+    'song_id':      'text', 'primary_key': 'song_id',
+    'band':         'text',
+    'album':        'text',
+    'nr':           'integer',
+    'title':        'text',
+    '_links':       'text',
+    'unique':       [('band', 'album', 'nr', 'title')],
+    'search':       ('band', 'album', 'title')
+}
+
+#--------------------------------
+# Migrations raise errors, so a failed one is not counted as applied
+def create_songs_table(database):
+    database.create_table(**songs_table, raise_errors=True)
+
+#--------------------------------
+def add_songs_change_log(database):
+    # create_table() creates only missing parts, here only the log of changes
+    database.create_table(**songs_table, changes=True, raise_errors=True)
+
+#--------------------------------
+# Summaries of songs for SQLiteDatabase.create_summary(), albums are summarized first,
+# because bands are summarized from albums
+songs_summaries = [
+    {
+        'table_name':   'songs',
+        'summary_name': 'songs_albums',
+        'group_by':     ('band', 'album'),
+        'order_by':     ('nr', 'title'),
+        'indexes':      [('album',)],
+        'tracks':       'count(*)',
+        'tracklist':    "json_group_array(json_object('song_id', song_id, 'nr', nr, 'title', title))"
+    },
+    {
+        'table_name':   'songs_albums',
+        'summary_name': 'songs_bands',
+        'group_by':     ('band',),
+        'albums':       'count(*)',
+        'tracks':       'sum(tracks)'
+    }
+]
+
+#--------------------------------
+def add_songs_summaries(database):
+    for summary in songs_summaries:
+        database.create_summary(**summary, raise_errors=True)
+
+#--------------------------------
+def update_songs_summaries_triggers(database):
+    # triggers of summaries are created again: albums are written by upsert
+    # and bands are kept by adding and subtracting tracks of albums
+    for summary in songs_summaries:
+        database.create_summary(**summary, incremental=True, raise_errors=True)
+
+#--------------------------------
+# Migrations of database for SQLiteDatabase.migrate(), applied once in this order,
+# new migrations are appended at the end
+migrations = [create_songs_table, add_songs_change_log, add_songs_summaries, update_songs_summaries_triggers]
+
 #================================================================
 class Song():
-    def __init__(self, band_name, album_name, nr, title):
+    __slots__ = ('band_name', 'album_name', 'nr', 'title', 'song_id')
+
+    def __init__(self, band_name, album_name, nr, title, song_id=None):
         self.band_name  = band_name
         self.album_name = album_name
         self.nr         = nr
         self.title      = title
-        self.song_id    = str(uuid4())
+        self.song_id    = str(song_id) if song_id else str(uuid4())
 
+    #--------------------------------
+    @classmethod
+    def from_row(cls, row, song_id=None):
+        """Create song from row of table 'songs' without generating a new ID."""
+
+        return cls(row['band'], row['album'], row['nr'], row['title'], song_id or row['song_id'])
 
+    #--------------------------------
     @property
     def _links(self):
         return {
@@ -18,6 +91,19 @@ class Song():
             'collection': "http://localhost:5000/songs"
         }
 
+    #--------------------------------
+    def dump(self):
+        """Return the same dict as SongSchema().dump(song), built directly."""
+
+        return {
+            'band_name':    self.band_name,
+            'album_name':   self.album_name,
+            'nr':           self.nr,
+            'title':        self.title,
+            'song_id':      self.song_id,
+            '_links':       self._links
+        }
+
     #--------------------------------
     def __repr__(self):
         return f"{self.band_name} - {self.title}"
@@ -42,4 +128,7 @@ class SongSchema(Schema):
 
     @post_load
     def make_song(self, data, **kwargs):
+        # ID is given by server, a client could send ID of another song
+        data.pop('song_id', None)
+        data.pop('_links', None)
         return Song(**data)
\ No newline at end of file
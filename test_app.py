@@ -1,7 +1,11 @@
-import unittest, requests, random
+import os, json, tempfile, threading, unittest, requests, random
+from urllib.parse import urljoin
+from werkzeug.serving import make_server
 
-session = requests.Session()
-local   = 'http://127.0.0.1:5000/songs'
+session     = requests.Session()
+server_url  = os.environ.get('SONGS_API_URL')   # e.g. http://127.0.0.1:5000, app is started in process if not set
+local       = f"{server_url}/songs"
+server      = None
 
 def add_to_session():
     bands   =   ["Ne Obliviscaris"]
@@ -23,6 +27,32 @@ def add_to_session():
                                         'title':        title   }
                             )
 
+#--------------------------------
+def setUpModule():
+    """Start app on a free local port with a temporary database
+    (unless SONGS_API_URL is set) and add songs of tests."""
+
+    global local, server, directory, application
+
+    if not server_url:
+        import app as application
+
+        directory   = tempfile.TemporaryDirectory()
+        server      = make_server('127.0.0.1', 0, application.create_app(os.path.join(directory.name, 'test.db')),
+                                  threaded=True)
+        local       = f"http://127.0.0.1:{server.server_port}/songs"
+
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    add_to_session()
+
+#--------------------------------
+def tearDownModule():
+    if server:
+        server.shutdown()
+        application.database.close()
+        directory.cleanup()
+
 #================================================================
 class TestGetResponse(unittest.TestCase):
     def test_get_all_songs(self):
@@ -37,6 +67,176 @@ class TestGetResponse(unittest.TestCase):
 
         assert response.status_code == 200
 
+    def test_get_songs_page(self):
+        first_page  = requests.get(local, params={'limit': 2})
+        after       = first_page.json()[-1]['song_id']
+        second_page = requests.get(local, params={'limit': 2, 'after': after})
+
+        assert first_page.status_code == 200
+        assert len(first_page.json()) == 2
+        assert 'next' in first_page.links
+        assert all(song['song_id'] > after for song in second_page.json())
+
+    def test_get_songs_page_with_offset(self):
+        def song_ids(response):
+            if response.headers['Content-Type'] == 'application/x-ndjson':
+                return [json.loads(line)['song_id'] for line in response.text.splitlines() if line]
+
+            return [song['song_id'] for song in response.json()]
+
+        expected = song_ids(requests.get(local, params={'limit': 6}))[4:]
+
+        for stream in ('false', 'true'):
+            first_page  = requests.get(local, params={'limit': 2, 'offset': 2, 'stream': stream})
+            second_page = requests.get(urljoin(local, first_page.links['next']['url']))
+
+            assert second_page.status_code == 200
+            assert song_ids(second_page) == expected
+
+    def test_get_songs_page_bad_limit(self):
+        response = requests.get(local, params={'limit': 'abc'})
+
+        assert response.status_code == 400
+
+    def test_get_songs_stream_page(self):
+        response    = requests.get(local, params={'stream': 'true', 'limit': 2})
+        songs       = [line for line in response.text.splitlines() if line]
+
+        assert len(songs) == 2
+        assert response.links['next']['url'].endswith(f"after={json.loads(songs[-1])['song_id']}")
+
+
+    def test_get_songs_filtered(self):
+        params      = {'band': 'Ne Obliviscaris', 'album': 'Urn', 'nr_min': 2, 'nr_max': 4,
+                       'fields': 'nr,title', 'order_by': '-nr'}
+        response    = requests.get(local, params=params)
+
+        assert response.status_code == 200
+        assert [song['nr'] for song in response.json()] == [4, 3, 2]
+        assert set(response.json()[0]) == {'nr', 'title'}
+
+
+    def test_get_songs_stream(self):
+        response    = requests.get(local, params={'stream': 'true'})
+        songs       = [line for line in response.text.splitlines() if line]
+
+        assert response.status_code == 200
+        assert response.headers['Content-Type'] == 'application/x-ndjson'
+        assert len(songs) == len(requests.get(local).json())
+
+    def test_get_songs_compressed(self):
+        plain       = requests.get(local, headers={'Accept-Encoding': 'identity'})
+        response    = requests.get(local, headers={'Accept-Encoding': 'gzip'})
+
+        assert response.status_code == 200
+        assert response.json() == plain.json()
+        assert 'Content-Encoding' not in plain.headers
+
+        if len(plain.content) >= 1024:
+            assert response.headers['Content-Encoding'] == 'gzip'
+
+    def test_get_songs_not_modified(self):
+        etag        = requests.get(local).headers['ETag']
+        response    = requests.get(local, headers={'If-None-Match': etag})
+
+        assert response.status_code == 304
+
+    def test_get_song_not_modified_by_other_writes(self):
+        song_id     = requests.get(local).json()[0]['song_id']
+        etag        = requests.get(f"{local}/{song_id}").headers['ETag']
+        song        = {'band_name': 'Nachtblut', 'album_name': 'Vanitas', 'nr': 10, 'title': "Other song"}
+
+        requests.post(local, json=song)
+        response    = requests.get(f"{local}/{song_id}", headers={'If-None-Match': etag})
+
+        assert response.status_code == 304
+
+    def test_get_songs_modified_in_same_second(self):
+        last_modified   = requests.get(local).headers['Last-Modified']
+        song            = {'band_name': 'Nachtblut', 'album_name': 'Vanitas', 'nr': 8, 'title': "Same second"}
+
+        requests.post(local, json=song)
+        response = requests.get(local, headers={'If-Modified-Since': last_modified})
+
+        assert response.status_code == 200
+
+
+    def test_search_songs(self):
+        response = requests.get(f"{local}/search", params={'q': 'obliviscaris'})
+
+        assert response.status_code == 200
+        assert all(song['band'] == 'Ne Obliviscaris' for song in response.json())
+
+    def test_search_songs_bad_limit(self):
+        for params in ({'limit': 'abc'}, {'offset': 'abc'}):
+            response = requests.get(f"{local}/search", params={'q': 'obliviscaris', **params})
+
+            assert response.status_code == 400
+
+
+    def test_get_song_by_id_from_cache(self):
+        song_id = requests.get(local).json()[0]['song_id']
+        before  = requests.get(local.replace('songs', 'cache')).json()
+
+        requests.get(f"{local}/{song_id}")
+        requests.get(f"{local}/{song_id}")
+        after   = requests.get(local.replace('songs', 'cache')).json()
+
+        assert after['hits'] > before['hits']
+
+    def test_lookup_songs(self):
+        song_ids    = [song['song_id'] for song in requests.get(local).json()[:3]]
+        response    = requests.post(f"{local}/lookup", json={'ids': song_ids + ['unknown']})
+
+        assert response.status_code == 200
+        assert list(response.json()['songs']) == song_ids
+        assert response.json()['missing'] == ['unknown']
+
+    def test_lookup_songs_bad_request(self):
+        for body in ([1], "x", {'ids': 'x'}):
+            response = requests.post(f"{local}/lookup", json=body)
+
+            assert response.status_code == 400
+
+    def test_get_metrics(self):
+        requests.get(local)
+        response = requests.get(local.replace('songs', 'metrics'))
+
+        assert response.status_code == 200
+        assert response.headers['Content-Type'].startswith('text/plain')
+        assert 'songs_http_requests_total{method="GET",endpoint="/songs",status="200"}' in response.text
+        assert 'songs_http_request_duration_seconds_bucket' in response.text
+
+    def test_get_songs_changes(self):
+        last    = requests.get(f"{local}/changes").json()['last']
+        song    = {'band_name': 'Nachtblut', 'album_name': 'Vanitas', 'nr': 9, 'title': "Changes"}
+
+        requests.post(local, json=song)
+        response = requests.get(f"{local}/changes", params={'since': last, 'wait': 1})
+        changes  = response.json()['changes']
+
+        assert response.status_code == 200
+        assert [change['operation'] for change in changes] == ['insert']
+        assert changes[0]['song']['title'] == "Changes"
+        assert response.json()['last'] == changes[0]['seq'] > last
+
+    def test_get_songs_changes_bad_request(self):
+        for params in ({'limit': 'abc'}, {'wait': 'abc'}, {'since': 'abc'}):
+            response = requests.get(f"{local}/changes", params={'since': 0, **params})
+
+            assert response.status_code == 400
+
+    def test_get_bands_and_albums(self):
+        songs   = requests.get(local, params={'band': 'Ne Obliviscaris', 'album': 'Urn'}).json()
+        bands   = requests.get(local.replace('songs', 'bands')).json()
+        albums  = requests.get(local.replace('songs', 'bands/Ne Obliviscaris/albums')).json()
+        urn     = requests.get(local.replace('songs', 'albums/Urn/songs'), params={'band': 'Ne Obliviscaris'})
+
+        assert urn.status_code == 200
+        assert 'Ne Obliviscaris' in [band['band'] for band in bands]
+        assert {'album': 'Urn', 'tracks': len(songs)} in albums
+        assert [track['nr'] for track in urn.json()[0]['tracklist']] == sorted(song['nr'] for song in songs)
+
     #----------------------------
     def test_post_song_first_time(self):
         song = {    'band_name':    'Nachtblut',
@@ -80,6 +280,45 @@ class TestGetResponse(unittest.TestCase):
 
         assert response.status_code == 400
 
+    def test_post_song_rate_limited(self):
+        if not server:
+            self.skipTest("limits of external server are not known")
+
+        limiter             = application.limiter
+        application.limiter = application.RateLimiter(write=(0.1, 1))
+
+        try:
+            requests.post(local, json={})
+            response = requests.post(local, json={})
+        finally:
+            application.limiter = limiter
+
+        assert response.status_code == 429
+        assert int(response.headers['Retry-After']) >= 1
+
+    def test_post_songs_bulk(self):
+        songs = [   {   'band_name':    'Nachtblut',
+                        'album_name':   'Vanitas',
+                        'nr':           nr,
+                        'title':        f"Bulk {nr}"    } for nr in range(1, 4)]
+
+        response = requests.post(f"{local}/bulk", json=songs + [songs[0], {'band_name': 'Nachtblut'}])
+        statuses = [song['status'] for song in response.json()['songs']]
+
+        assert response.status_code == 201
+        assert statuses[3:] == ['duplicate', 'invalid']
+
+    def test_post_songs_bulk_with_song_id(self):
+        song_id     = requests.get(local).json()[0]['song_id']
+        song        = {'band_name': 'Nachtblut', 'album_name': 'Vanitas', 'nr': 7, 'title': "Own ID",
+                       'song_id': song_id}
+        response    = requests.post(f"{local}/bulk", json=[song])
+        created     = response.json()['songs'][0]
+
+        assert created['status'] == 'created'
+        assert created['song_id'] != song_id
+        assert requests.get(f"{local}/{created['song_id']}").json()['title'] == "Own ID"
+
     #----------------------------
     def test_put_song(self):
         song_id         = requests.get(local).json()[len(requests.get(local).json()) - 1]['song_id']
@@ -124,5 +363,4 @@ class TestGetResponse(unittest.TestCase):
 
 #================================================================
 if __name__ == '__main__':
-    add_to_session()
     unittest.main()
@@ -0,0 +1,119 @@
+import os, json, asyncio, tempfile, unittest
+
+import async_app
+from async_database import AsyncSQLiteDatabase
+from models import migrations
+
+#================================================================
+class TestAsyncApp(unittest.IsolatedAsyncioTestCase):
+    """ASGI application called in process, like asgi_get() of benchmark.py."""
+
+    async def asyncSetUp(self):
+        self.directory      = tempfile.TemporaryDirectory()
+        async_app.database  = AsyncSQLiteDatabase(os.path.join(self.directory.name, 'test.db'))
+        self.lifespan       = asyncio.Queue()
+        self.started        = asyncio.Queue()
+
+        async def send(message):
+            await self.started.put(message['type'])
+
+        self.task = asyncio.create_task(async_app.app({'type': 'lifespan'}, self.lifespan.get, send))
+
+        await self.lifespan.put({'type': 'lifespan.startup'})
+        assert await self.started.get() == 'lifespan.startup.complete'
+
+    async def asyncTearDown(self):
+        await self.lifespan.put({'type': 'lifespan.shutdown'})
+        await self.task
+
+        assert await self.started.get() == 'lifespan.shutdown.complete'
+        self.directory.cleanup()
+
+    async def request(self, method, path, body=None):
+        """Return status, headers and JSON of response."""
+
+        path, _, query  = path.partition('?')
+        messages        = []
+        body            = body if isinstance(body, bytes) else json.dumps(body).encode() if body is not None else b''
+
+        async def receive():
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+
+        async def send(message):
+            messages.append(message)
+
+        await async_app.app({'type': 'http', 'method': method, 'path': path, 'query_string': query.encode()},
+                            receive, send)
+
+        headers = {name.decode(): value.decode() for name, value in messages[0]['headers']}
+
+        return messages[0]['status'], headers, json.loads(messages[1]['body'])
+
+    async def add_songs(self, count):
+        for nr in range(1, count + 1):
+            song    = {'band_name': 'Band', 'album_name': 'Album', 'nr': nr, 'title': f"Title {nr}"}
+            status  = (await self.request('POST', '/songs', song))[0]
+
+            assert status == 201
+
+    #----------------------------
+    async def test_lifespan_migrates(self):
+        version = await async_app.database._run(
+            lambda: async_app.database.database.connection.execute("PRAGMA user_version").fetchone()[0])
+
+        assert version == len(migrations)
+        assert (await self.request('GET', '/songs'))[::2] == (200, [])
+
+    async def test_write_and_read_song(self):
+        await self.add_songs(2)
+        song        = {'band_name': 'Band', 'album_name': 'Album', 'nr': 1, 'title': "Title 1"}
+        songs       = (await self.request('GET', '/songs'))[2]
+        song_id     = songs[0]['song_id']
+        other       = {'band_name': 'Band', 'album_name': 'Album', 'nr': songs[1]['nr'], 'title': songs[1]['title']}
+
+        assert (await self.request('POST', '/songs', song))[0] == 409
+
+        status, _, data = await self.request('GET', f"/songs/{song_id}")
+
+        assert status == 200
+        assert data['song_id'] == song_id
+
+        assert (await self.request('PUT', f"/songs/{song_id}", {**other, 'nr': 5}))[0] == 200
+        assert (await self.request('GET', f"/songs/{song_id}"))[2]['nr'] == 5
+        assert (await self.request('PUT', f"/songs/{song_id}", other))[0] == 409
+
+        assert (await self.request('DELETE', f"/songs/{song_id}"))[0] == 200
+        assert (await self.request('GET', f"/songs/{song_id}"))[0] == 404
+        assert (await self.request('DELETE', f"/songs/{song_id}"))[0] == 404
+
+    async def test_bad_requests(self):
+        await self.add_songs(1)
+        song_id = (await self.request('GET', '/songs'))[2][0]['song_id']
+
+        assert (await self.request('POST', '/songs', b'{"band_name": '))[0] == 400
+        assert (await self.request('POST', '/songs', {'band_name': 'Band', 'album_name': 'Album'}))[0] == 400
+        assert (await self.request('PUT', f"/songs/{song_id}", {'nr': 'x'}))[0] == 400
+        assert (await self.request('GET', '/songs?limit=abc'))[0] == 400
+        assert (await self.request('GET', '/songs?limit=0'))[0] == 400
+        assert (await self.request('GET', '/albums'))[0] == 404
+
+    async def test_pages(self):
+        await self.add_songs(5)
+        path        = '/songs?limit=2'
+        song_ids    = []
+
+        while path:
+            status, headers, songs = await self.request('GET', path)
+
+            assert status == 200
+            assert len(songs) <= 2
+
+            song_ids    += [song['song_id'] for song in songs]
+            path        = headers['link'][1:headers['link'].index('>')] if 'link' in headers else None
+
+        assert song_ids == sorted(song['song_id'] for song in (await self.request('GET', '/songs'))[2])
+        assert len(song_ids) == 5
+
+#================================================================
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,40 @@
+import time, unittest
+
+from cache import LRUCache
+
+#================================================================
+class TestLRUCache(unittest.TestCase):
+    def test_evict_least_recently_used(self):
+        cache = LRUCache(max_size=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+
+        assert cache.get('b') is None
+        assert (cache.get('a'), cache.get('c')) == (1, 3)
+        assert cache.evictions == 1
+
+    def test_expire(self):
+        cache = LRUCache(ttl=0.01)
+        cache.set('a', 1)
+        time.sleep(0.02)
+
+        assert cache.get('a') is None
+
+    def test_set_after_invalidation(self):
+        # reader loaded 'a' before a write of 'a' was invalidated, its value is old
+        cache   = LRUCache()
+        version = cache.version
+        cache.invalidate('a')
+        cache.set('a', 'old', version=version)
+
+        assert cache.get('a') is None
+
+        cache.set('a', 'new', version=cache.version)
+
+        assert cache.get('a') == 'new'
+
+#================================================================
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,398 @@
+import os, time, sqlite3, tempfile, threading, unittest
+
+from database import SQLiteDatabase, SQLiteReplica
+from models import migrations
+
+#--------------------------------
+def make_song(song_id, title=None, **values):
+    return {'song_id': song_id, 'band': 'Band', 'album': 'Album', 'nr': 1, 'title': title or song_id, **values}
+
+#================================================================
+class TestAddMany(unittest.TestCase):
+    def setUp(self):
+        self.directory  = tempfile.TemporaryDirectory()
+        self.database   = SQLiteDatabase(file=os.path.join(self.directory.name, 'test.db'))
+        self.database.migrate(migrations)
+
+    def tearDown(self):
+        self.database.close()
+        self.directory.cleanup()
+
+    def test_add_many_statuses(self):
+        with self.database as database:
+            database.add_to_table('songs', **make_song('a'))
+            statuses = database.add_many('songs', [make_song('a', 'new'), make_song('b'), make_song('b', 'new'),
+                                                   make_song('c', 'a')], key='song_id', on_conflict='nothing')
+
+        assert statuses == [False, True, False, False]
+
+    def test_add_many_error(self):
+        rows = (make_song(song_id) for song_id in ('a', 'b', 'a', 'c', 'd'))
+
+        with self.database as database:
+            statuses    = database.add_many('songs', rows, key='song_id', batch_size=2)
+            songs       = database.select_from_table('songs')
+
+        assert statuses == [None] * 5
+        assert songs == []
+
+    def test_add_many_raise_errors(self):
+        with self.database as database:
+            with self.assertRaises(sqlite3.IntegrityError):
+                database.add_many('songs', [make_song('a'), make_song('a', 'b')], key='song_id', raise_errors=True)
+
+            assert database.select_from_table('songs') == []
+
+#================================================================
+class TestWrites(unittest.TestCase):
+    def setUp(self):
+        self.directory  = tempfile.TemporaryDirectory()
+        self.database   = SQLiteDatabase(file=os.path.join(self.directory.name, 'test.db'), busy_timeout=100)
+        self.database.migrate(migrations)
+
+        with self.database as database:
+            database.add_to_table('songs', **make_song('a'))
+
+    def tearDown(self):
+        self.database.close()
+        self.directory.cleanup()
+
+    def test_write_conflict(self):
+        with self.database as database:
+            assert database.add_to_table('songs', **make_song('a', 'b')) is False
+            assert database.add_to_table('songs', on_conflict='nothing', **make_song('b', 'a')) is False
+            assert database.update_row('songs', {'name': 'song_id', 'value': 'missing'}, title="b") is False
+
+    def test_write_locked(self):
+        locker = sqlite3.connect(self.database.file)
+        locker.execute("BEGIN IMMEDIATE")
+
+        try:
+            with self.database as database:
+                added       = database.add_to_table('songs', on_conflict='nothing', **make_song('b'))
+                modified    = database.update_row('songs', {'name': 'song_id', 'value': 'a'}, title="b")
+        finally:
+            locker.rollback()
+            locker.close()
+
+        assert added is None
+        assert modified is None
+
+#================================================================
+class TestMigrations(unittest.TestCase):
+    def setUp(self):
+        self.directory  = tempfile.TemporaryDirectory()
+        self.file       = os.path.join(self.directory.name, 'test.db')
+
+        # file made before migrations, without unique index, search and log of changes
+        with sqlite3.connect(self.file) as connection:
+            connection.execute("CREATE TABLE songs (song_id text PRIMARY KEY, band text, album text, "
+                               "nr integer, title text, _links text)")
+            connection.executemany("INSERT INTO songs VALUES(:song_id, :band, :album, :nr, :title, NULL)",
+                                   [make_song('a'), make_song('b')])
+
+        connection.close()
+        self.database = SQLiteDatabase(file=self.file)
+
+    def tearDown(self):
+        self.database.close()
+        self.directory.cleanup()
+
+    def user_version(self):
+        with self.database as database:
+            return database.connection.execute("PRAGMA user_version").fetchone()[0]
+
+    def test_migrate_existing_file(self):
+        applied = self.database.migrate(migrations)
+
+        with self.database as database:
+            found   = database.search('songs', 'album')
+            albums  = database.select_from_table('songs_albums')
+
+        assert applied == len(migrations)
+        assert self.user_version() == len(migrations)
+        assert sorted(song['song_id'] for song in found) == ['a', 'b']
+        assert albums[0]['tracks'] == 2
+
+    def test_migrate_step_by_step(self):
+        def tables():
+            with self.database as database:
+                return {row[0] for row in database.connection.execute("SELECT name FROM sqlite_master")}
+
+        self.database.migrate(migrations[:1])
+        assert 'songs_changes' not in tables()
+
+        self.database.migrate(migrations[:2])
+        assert 'songs_changes' in tables()
+        assert 'songs_albums' not in tables()
+
+    def test_migrate_failed(self):
+        # duplicate (band, album, nr, title) breaks unique index of the first migration
+        with sqlite3.connect(self.file) as connection:
+            connection.execute("INSERT INTO songs VALUES('c', 'Band', 'Album', 1, 'a', NULL)")
+
+        connection.close()
+
+        with self.assertRaises(sqlite3.IntegrityError):
+            self.database.migrate(migrations)
+
+        assert self.user_version() == 0
+
+        with self.database as database:
+            database.delete('songs', song_id='c')
+
+        assert self.database.migrate(migrations) == len(migrations)
+        assert self.user_version() == len(migrations)
+
+#================================================================
+class TestSummaries(unittest.TestCase):
+    def setUp(self):
+        self.directory  = tempfile.TemporaryDirectory()
+        self.database   = SQLiteDatabase(file=os.path.join(self.directory.name, 'test.db'))
+        self.database.migrate(migrations)
+
+    def tearDown(self):
+        self.database.close()
+        self.directory.cleanup()
+
+    def bands(self):
+        with self.database as database:
+            return {band['band']: (band['albums'], band['tracks']) for band in database.select_from_table('songs_bands')}
+
+    def test_summaries_follow_writes(self):
+        songs = [make_song(f"{album}{nr}", band=band, album=album, nr=nr)
+                 for band, album in (('A', 'a1'), ('A', 'a2'), ('B', 'b1')) for nr in (1, 2, 3)]
+
+        with self.database as database:
+            database.add_many('songs', songs, key='song_id')
+
+        assert self.bands() == {'A': (2, 6), 'B': (1, 3)}
+
+        with self.database as database:
+            database.update_row('songs', {'name': 'song_id', 'value': 'a11'}, band='B', album='b1', nr=4)
+            database.update_row('songs', {'name': 'song_id', 'value': 'a12'}, title="Renamed")
+
+        assert self.bands() == {'A': (2, 5), 'B': (1, 4)}
+
+        with self.database as database:
+            for song_id in ('a12', 'a13', 'b11', 'b12', 'b13', 'a11'):
+                database.delete('songs', song_id=song_id)
+
+            albums = database.select_from_table('songs_albums')
+
+        assert self.bands() == {'A': (1, 3)}
+        assert [(album['album'], album['tracks']) for album in albums] == [('a2', 3)]
+
+    def test_summaries_upgraded(self):
+        # file with summaries of migration 3, which replace rows of groups
+        self.database.close()
+        self.database = SQLiteDatabase(file=os.path.join(self.directory.name, 'upgraded.db'))
+        self.database.migrate(migrations[:3])
+
+        with self.database as database:
+            database.add_many('songs', [make_song(f"a{nr}", album='a', nr=nr) for nr in (1, 2)], key='song_id')
+
+        self.database.migrate(migrations)
+
+        with self.database as database:
+            database.add_to_table('songs', **make_song('b1', album='b'))
+            database.update_row('songs', {'name': 'song_id', 'value': 'a1'}, album='b', nr=2)
+
+        assert self.bands() == {'Band': (2, 3)}
+
+#================================================================
+class TestGroupCommit(unittest.TestCase):
+    def setUp(self):
+        self.directory  = tempfile.TemporaryDirectory()
+        self.database   = SQLiteDatabase(file=os.path.join(self.directory.name, 'test.db'), group_commit=True)
+        self.database.migrate(migrations)
+
+    def tearDown(self):
+        self.database.writer.stop()
+        self.database.close()
+        self.directory.cleanup()
+
+    def add_songs(self, thread, count):
+        with self.database as database:
+            for nr in range(count):
+                database.add_to_table('songs', **make_song(f"{thread}-{nr}"))
+
+    def test_group_commit_threads(self):
+        threads = [threading.Thread(target=self.add_songs, args=(thread, 20)) for thread in range(8)]
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        with self.database as database:
+            songs = database.select_from_table('songs')
+
+        stats = self.database.writer.stats
+
+        assert len(songs) == 160
+        assert stats['writes'] == 160
+        assert 0 < stats['groups'] <= 160
+
+    def test_group_commit_failed_write(self):
+        def fail(database):
+            database.add_to_table('songs', **make_song('failed'))
+            raise ValueError("Write failed")
+
+        self.add_songs('before', 1)
+
+        with self.assertRaises(ValueError):
+            self.database.writer.submit(fail, self.database)
+
+        self.add_songs('after', 1)
+
+        with self.database as database:
+            song_ids = {song['song_id'] for song in database.select_from_table('songs')}
+
+        assert song_ids == {'before-0', 'after-0'}
+
+    def test_group_commit_lost_transaction(self):
+        def rollback(database):
+            # like SQLite after a full disk: transaction and savepoints are gone
+            database.connection.rollback()
+            raise sqlite3.OperationalError("database or disk is full")
+
+        with self.assertRaises(sqlite3.Error):
+            self.database.writer.submit(rollback, self.database)
+
+        self.add_songs('after', 2)
+
+        with self.database as database:
+            assert len(database.select_from_table('songs')) == 2
+
+        assert self.database.writer._thread.is_alive()
+
+#================================================================
+class TestReplica(unittest.TestCase):
+    def setUp(self):
+        self.directory  = tempfile.TemporaryDirectory()
+        self.database   = SQLiteDatabase(file=os.path.join(self.directory.name, 'test.db'))
+        self.database.migrate(migrations)
+        self.replica    = SQLiteReplica(self.database, file=os.path.join(self.directory.name, 'replica.db'),
+                                        max_staleness=60)
+
+        with self.database as database:
+            database.add_to_table('songs', **make_song('a'))
+
+    def tearDown(self):
+        self.replica.close()
+        self.database.close()
+        self.directory.cleanup()
+
+    def song_ids(self):
+        with self.replica as replica:
+            return {song['song_id'] for song in replica.select_from_table('songs')}
+
+    def add_song_elsewhere(self, song_id):
+        # like another process, replica is not told about this commit
+        with sqlite3.connect(self.database.file) as connection:
+            connection.execute("INSERT INTO songs (song_id, band, album, nr, title) VALUES(?, 'Band', 'Album', 2, ?)",
+                               (song_id, song_id))
+
+        connection.close()
+
+    def test_replica_refresh(self):
+        assert self.song_ids() == {'a'}
+        assert self.replica.stats['copies'] == 1
+
+        self.replica.max_staleness = 0
+        time.sleep(0.01)
+
+        assert self.song_ids() == {'a'}
+        assert self.replica.stats['refreshes'] == 2
+        assert self.replica.stats['copies'] == 1     # primary has not changed
+
+        self.add_song_elsewhere('b')
+        time.sleep(0.01)
+
+        assert self.song_ids() == {'a', 'b'}
+        assert self.replica.stats['copies'] == 2
+
+    def test_replica_staleness(self):
+        self.song_ids()
+        self.add_song_elsewhere('b')
+
+        for _ in range(3):
+            assert self.song_ids() == {'a'}
+
+        assert self.replica.stats['copies'] == 1
+
+        self.replica.expire()
+
+        assert self.song_ids() == {'a', 'b'}
+        assert self.replica.stats['copies'] == 2
+
+    def test_replica_reads_own_writes(self):
+        self.song_ids()
+
+        for song_id in ('b', 'c', 'd'):
+            with self.database as database:
+                database.add_to_table('songs', **make_song(song_id, nr=ord(song_id)))
+
+            assert song_id in self.song_ids()
+
+        stats = self.replica.stats
+
+        assert stats['copies'] == 1                  # writes do not force copies within max_staleness
+        assert stats['primary_reads'] == 3
+
+        self.replica.expire()
+
+        assert self.song_ids() == {'a', 'b', 'c', 'd'}
+        assert self.replica.stats['copies'] == 2
+        assert self.replica.stats['primary_reads'] == 3
+
+    def test_replica_path_with_uri_characters(self):
+        directory   = os.path.join(self.directory.name, 'songs?mode=rw#%41')
+        os.mkdir(directory)
+        database    = SQLiteDatabase(file=os.path.join(directory, 'test.db'))
+        database.migrate(migrations)
+        replica     = SQLiteReplica(database, file=os.path.join(directory, 'replica.db'), max_staleness=60)
+
+        try:
+            with replica:
+                empty = replica.select_from_table('songs')
+
+            with database:
+                database.add_to_table('songs', **make_song('b'))
+
+            with replica:
+                from_primary = replica.select_from_table('songs')
+
+            replica.expire()
+
+            with replica:
+                from_copy = replica.select_from_table('songs')
+
+            stats = replica.stats
+        finally:
+            replica.close()
+            database.close()
+
+        assert empty == []
+        assert [song['song_id'] for song in from_primary] == [song['song_id'] for song in from_copy] == ['b']
+        assert stats['primary_reads'] == 1
+        assert stats['copies'] == 2
+
+    def test_replica_generation_reopen(self):
+        with self.replica as replica:
+            old = replica.connection
+            replica.select_from_table('songs')
+
+        self.add_song_elsewhere('b')
+        self.replica.expire()
+
+        with self.replica as replica:
+            assert replica.connection is not old
+            assert replica.connection.generation == replica.generation == 2
+            assert len(replica.select_from_table('songs')) == 2
+
+#================================================================
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+import os, json, sqlite3, tempfile, unittest
+
+from database import SQLiteDatabase
+from models import migrations
+from transfer import guess_format, open_stream, export_table, import_table, columns
+
+songs = [
+    {'song_id': 'a', 'band': 'Band', 'album': 'Album', 'nr': 1, 'title': "First"},
+    {'song_id': 'b', 'band': 'Band', 'album': 'Album', 'nr': 2, 'title': ""},
+    {'song_id': 'c', 'band': 'Band', 'album': 'Album', 'nr': None, 'title': "\\N"},
+    {'song_id': 'd', 'band': 'Band', 'album': 'Other', 'nr': 1, 'title': "Comma, \"quote\"\nand new line"},
+]
+
+#================================================================
+class TestTransfer(unittest.TestCase):
+    def setUp(self):
+        self.directory  = tempfile.TemporaryDirectory()
+        self.source     = self.open_database('source.db')
+        self.target     = self.open_database('target.db')
+
+        with self.source as database:
+            database.add_many('songs', songs, key='song_id', raise_errors=True)
+
+    def tearDown(self):
+        self.source.close()
+        self.target.close()
+        self.directory.cleanup()
+
+    def open_database(self, name):
+        database = SQLiteDatabase(file=os.path.join(self.directory.name, name))
+        database.migrate(migrations)
+
+        return database
+
+    def path(self, name):
+        return os.path.join(self.directory.name, name)
+
+    def export(self, name):
+        with open_stream(self.path(name), 'w') as stream:
+            return export_table(self.source, stream, guess_format(name))
+
+    def load(self, name, **options):
+        with open_stream(self.path(name), 'r') as stream:
+            return import_table(self.target, stream, guess_format(name), batch_size=2, **options)
+
+    def target_songs(self):
+        with self.target as database:
+            return database.select_from_table('songs', select=columns, order_by='song_id')
+
+    #----------------------------
+    def test_round_trip(self):
+        for name in ('songs.ndjson', 'songs.csv', 'songs.csv.gz', 'songs.columnar'):
+            with self.subTest(name):
+                with self.target as database:
+                    database.connection.execute("DELETE FROM songs")
+                    database.connection.commit()
+
+                assert self.export(name) == len(songs)
+                assert self.load(name) == (len(songs), len(songs))
+                assert self.target_songs() == songs
+
+    def test_import_dedup(self):
+        for name in ('songs.ndjson', 'songs.csv'):
+            with self.subTest(name):
+                self.export(name)
+
+                with self.target as database:
+                    database.connection.execute("DELETE FROM songs")
+                    database.add_to_table('songs', **songs[0])
+
+                assert self.load(name, dedup=True) == (len(songs), len(songs) - 1)
+                assert self.load(name, dedup=True) == (len(songs), 0)
+                assert self.target_songs() == songs
+
+    def test_import_duplicate(self):
+        self.export('songs.csv')
+
+        with self.target as database:
+            database.add_to_table('songs', **songs[-1])
+
+        with self.assertRaises(sqlite3.IntegrityError):
+            self.load('songs.csv')
+
+        assert self.target_songs() == songs[-1:]
+
+    def test_import_bad_line(self):
+        # error after the first batch of 2 rows is inserted
+        with open(self.path('songs.ndjson'), 'w') as file:
+            file.writelines(json.dumps(song) + '\n' for song in songs[:3])
+            file.write('{"song_id": "x", \n')
+
+        with self.assertRaises(ValueError):
+            self.load('songs.ndjson')
+
+        assert self.target_songs() == []
+
+    def test_import_bad_chunk(self):
+        self.export('songs.columnar')
+
+        with open(self.path('songs.columnar'), 'a') as file:
+            file.write('[["x"], ["Band"]\n')
+
+        with self.assertRaises(ValueError):
+            self.load('songs.columnar')
+
+        assert self.target_songs() == []
+
+#================================================================
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,255 @@
+import os, sys, csv, json, gzip, time, sqlite3, argparse, itertools, logging
+from contextlib import nullcontext
+
+from database import SQLiteDatabase
+from encoding import get_json_encoder
+from models import migrations
+
+logger = logging.getLogger(__name__)
+
+#================================================================
+# Bulk export and import of table of songs, run with:
+#   python transfer.py export songs.csv.gz
+#   python transfer.py import songs.csv.gz --dedup
+database_file   = os.environ.get('SONGS_DATABASE', "db_file.db")
+table_name      = 'songs'
+key             = 'song_id'
+columns         = ('song_id', 'band', 'album', 'nr', 'title')
+chunk_size      = 5_000
+extensions      = {'.ndjson': 'ndjson', '.jsonl': 'ndjson', '.csv': 'csv', '.columnar': 'columnar'}
+null            = '\\N'            # None in CSV, so an empty string stays an empty string
+
+#--------------------------------
+def guess_format(file):
+    """Return format of file by its extension, .gz is skipped."""
+
+    name = file[:-3] if file.endswith('.gz') else file
+
+    return extensions.get(os.path.splitext(name)[1], 'ndjson')
+
+#--------------------------------
+def open_stream(file, mode):
+    """Open text stream of file, gzip if name ends with .gz, '-' for stdin/stdout."""
+
+    if file == '-':
+        return nullcontext(sys.stdin if mode == 'r' else sys.stdout)
+
+    if file.endswith('.gz'):
+        # level 1 is several times faster than default 9 and almost as small for repeated names
+        return gzip.open(file, mode + 't', compresslevel=1, encoding='utf-8', newline='')
+
+    return open(file, mode, encoding='utf-8', newline='')
+
+#================================================================
+# Writers get an iterable of tuples of values and return number of rows
+def write_ndjson(stream, columns, rows):
+    dumps = get_json_encoder()
+    count = 0
+
+    for row in rows:
+        stream.write(dumps(dict(zip(columns, row))) + '\n')
+        count += 1
+
+    return count
+
+#--------------------------------
+def encode_csv(value):
+    """Return None as null marker, string starting with backslash gets one more backslash."""
+
+    if value is None:
+        return null
+
+    if isinstance(value, str) and value.startswith('\\'):
+        return '\\' + value
+
+    return value
+
+#--------------------------------
+def write_csv(stream, columns, rows):
+    """CSV with header, None is written as null marker \\N."""
+
+    writer  = csv.writer(stream)
+    count   = 0
+
+    writer.writerow(columns)
+
+    for chunk in iter(lambda: list(itertools.islice(rows, chunk_size)), []):
+        writer.writerows([encode_csv(value) for value in row] for row in chunk)
+        count += len(chunk)
+
+    return count
+
+#--------------------------------
+def encode_column(values):
+    """Return column as list, or as dictionary of distinct values with their indexes,
+    if values repeat (e.g. band and album)."""
+
+    dictionary  = {}
+    indexes     = [dictionary.setdefault(value, len(dictionary)) for value in values]
+
+    if len(dictionary) * 2 <= len(values):
+        return {'dictionary': list(dictionary), 'indexes': indexes}
+
+    return list(values)
+
+#--------------------------------
+def write_columnar(stream, columns, rows):
+    """Header line with names of columns, then one JSON line of columns for every chunk of rows."""
+
+    dumps = get_json_encoder()
+    count = 0
+
+    stream.write(dumps({'format': 'columnar', 'version': 1, 'columns': list(columns)}) + '\n')
+
+    for chunk in iter(lambda: list(itertools.islice(rows, chunk_size)), []):
+        stream.write(dumps([encode_column(values) for values in zip(*chunk)]) + '\n')
+        count += len(chunk)
+
+    return count
+
+#--------------------------------
+writers = {'ndjson': write_ndjson, 'csv': write_csv, 'columnar': write_columnar}
+
+#================================================================
+# Readers yield dicts with given columns, missing values are None
+def read_ndjson(stream, columns):
+    for line in stream:
+        if line.strip():
+            row = json.loads(line)
+            yield {name: row.get(name) for name in columns}
+
+#--------------------------------
+def decode_csv(value):
+    """Reverse of encode_csv(), missing value is None."""
+
+    if value is None or value == null:
+        return None
+
+    if value.startswith('\\'):
+        return value[1:]
+
+    return value
+
+#--------------------------------
+def read_csv(stream, columns):
+    for row in csv.DictReader(stream):
+        yield {name: decode_csv(row.get(name)) for name in columns}
+
+#--------------------------------
+def decode_column(column):
+    if isinstance(column, dict):
+        dictionary = column['dictionary']
+        return [dictionary[index] for index in column['indexes']]
+
+    return column
+
+#--------------------------------
+def read_columnar(stream, columns):
+    header = json.loads(stream.readline() or 'null')
+
+    if not header or header.get('format') != 'columnar':
+        raise ValueError("Stream is not in columnar format")
+
+    names = header['columns']
+
+    for line in stream:
+        if line.strip():
+            chunk = dict(zip(names, map(decode_column, json.loads(line))))
+            size  = len(next(iter(chunk.values()), ()))
+
+            yield from ({name: chunk[name][i] if name in chunk else None for name in columns}
+                        for i in range(size))
+
+#--------------------------------
+readers = {'ndjson': read_ndjson, 'csv': read_csv, 'columnar': read_columnar}
+
+#================================================================
+def export_table(database, stream, file_format, *, table_name=table_name, columns=columns,
+                 chunk_size=chunk_size):
+    """Write all rows of table to stream.
+    Rows are read from one cursor chunk by chunk, so memory does not grow with table.
+    Requirement:
+        database    - SQLiteDatabase
+        stream      - text stream open for writing
+        file_format - 'ndjson', 'csv' or 'columnar'
+
+    Optional:
+        table_name  - name of a table
+        columns     - exported columns
+        chunk_size  - number of rows fetched from cursor at once
+
+    Return:
+        Number of exported rows."""
+
+    rows = database.iter_select(table_name, select=columns, chunk_size=chunk_size, as_tuple=True)
+
+    return writers[file_format](stream, columns, rows)
+
+#--------------------------------
+def import_table(database, stream, file_format, *, table_name=table_name, key=key, columns=columns,
+                 batch_size=chunk_size, dedup=False):
+    """Add rows from stream to table in one transaction, on error nothing is added
+    and the error is raised (sqlite3.Error, or ValueError of a bad line of stream).
+    Rows are inserted by executemany() in batches while the stream is read.
+    Requirement:
+        database    - SQLiteDatabase
+        stream      - text stream open for reading
+        file_format - 'ndjson', 'csv' or 'columnar'
+
+    Optional:
+        table_name  - name of a table
+        key         - column with unique value of every row
+        columns     - imported columns
+        batch_size  - number of rows inserted by one executemany() call
+        dedup       - skip rows which are already in table (same key or same
+                      band, album, nr and title) instead of failing
+
+    Return:
+        Tuple of numbers of read and added rows."""
+
+    rows = readers[file_format](stream, columns)
+
+    with database:
+        statuses = database.add_many(table_name, rows, key=key, batch_size=batch_size,
+                                     on_conflict='nothing' if dedup else None, raise_errors=True)
+
+    return len(statuses), statuses.count(True)
+
+#================================================================
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Export or import table of songs as NDJSON, CSV or columnar stream.")
+    parser.add_argument('command', choices=('export', 'import'))
+    parser.add_argument('file', help="file, .gz is compressed, '-' for stdout/stdin")
+    parser.add_argument('--database', default=database_file, help="file of database")
+    parser.add_argument('--format', choices=tuple(writers), help="format of file, by extension by default")
+    parser.add_argument('--chunk-size', type=int, default=chunk_size, help="rows read or inserted at once")
+    parser.add_argument('--dedup', action='store_true', help="skip songs which are already in database")
+    arguments = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    file_format = arguments.format or guess_format(arguments.file)
+    database    = SQLiteDatabase(file=arguments.database)
+    database.migrate(migrations)
+    start       = time.perf_counter()
+
+    try:
+        if arguments.command == 'export':
+            with open_stream(arguments.file, 'w') as stream:
+                read = export_table(database, stream, file_format, chunk_size=arguments.chunk_size)
+                summary = f"Exported {read} rows"
+        else:
+            with open_stream(arguments.file, 'r') as stream:
+                read, added = import_table(database, stream, file_format, batch_size=arguments.chunk_size,
+                                           dedup=arguments.dedup)
+                summary = f"Imported {added} of {read} rows"
+    except (ValueError, KeyError, csv.Error, sqlite3.Error) as error:
+        logger.error("%s of %s failed: %s", arguments.command.capitalize(), arguments.file, error)
+        sys.exit(1)
+    finally:
+        database.close()
+
+    duration = time.perf_counter() - start
+
+    logger.info("%s as %s in %.2f s, %.0f rows/s", summary, file_format, duration,
+                read / duration if duration else 0)